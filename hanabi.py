@@ -1,27 +1,91 @@
-from collections import deque
+from collections import OrderedDict, deque
 from enum import Enum
+from itertools import permutations
+from math import sqrt
+from multiprocessing import Pool
 from numpy import random
+from time import perf_counter
+
+
+MAX_SCORE = 25
+
+
+def default_hand_size(n_players):
+    return 5 if n_players <= 3 else 4
 
 
 class Hanabi:
-    def __init__(self, deck, move_search):
-        self.deck = Deck(deck)
+    def __init__(self, deck, move_search, recorder=None, n_players=2, hand_size=None, rng=None):
+        if hand_size is None:
+            hand_size = default_hand_size(n_players)
+        self._start(Deck(deck, rng), n_players)
+        if recorder is not None:
+            self.recording = recorder.start_game(self.deck.deck, n_players, hand_size)
+        starting_cards = []
+        for _ in range(n_players * hand_size):
+            starting_cards.append(self.deck.draw())
+        self.players = [Player(starting_cards[seat * hand_size:(seat + 1) * hand_size], self,
+                               move_search, seat)
+                        for seat in range(n_players)]
+        for seat, player in enumerate(self.players):
+            player.partner = self.players[(seat + 1) % n_players]
+        self.player1 = self.players[0]
+        self.player2 = self.players[1]
+
+    @classmethod
+    def without_players(cls, deck, n_players=2):
+        """A game at the starting board drawing from deck, which may be any
+        object with Deck's interface, and with no players yet, for building up
+        a game from what one player can see of it."""
+        game = cls.__new__(cls)
+        game._start(deck, n_players)
+        return game
+
+    def _start(self, deck, n_players):
+        self.deck = deck
+        self.recording = None
         self.play_area = PlayArea()
         self.discard_pile = []
         self.time = 8
         self.fuse = 3
         self.end_trigger = False
-        self.turns_after_trigger = 2
+        self.turns_after_trigger = n_players
         self.blown_up = False
-        starting_cards = []
-        for _ in range(10):
-            starting_cards.append(self.deck.draw())
-        self.player1 = Player(starting_cards[:5], self, move_search)
-        self.player2 = Player(starting_cards[5:], self, move_search)
-        self.player1.partner = self.player2
-        self.player2.partner = self.player1
+        self.turns = 0
+        self.card_counts = full_count_matrix()
+        # Cards in any player's hand, so each player's unseen cards can be found
+        # without walking the other hands.
+        self.held_counts = empty_count_matrix()
+        self.version = 0
+        self._rare_version = -1
+        self._rare_mask = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def clone(self):
+        """An independent copy of the game that shares only the immutable cards.
+
+        Much cheaper than copy.deepcopy, for search players that simulate ahead.
+        The copy does not record to the original's log.
+        """
+        game = Hanabi.__new__(Hanabi)
+        game.__dict__.update(self.__dict__)
+        game.deck = self.deck.clone()
+        game.recording = None
+        game.play_area = self.play_area.clone()
+        game.discard_pile = list(self.discard_pile)
+        game.card_counts = list(self.card_counts)
+        game.held_counts = list(self.held_counts)
+        game.players = [player.clone(game) for player in self.players]
+        for seat, player in enumerate(game.players):
+            player.partner = game.players[(seat + 1) % len(game.players)]
+        game.player1 = game.players[0]
+        game.player2 = game.players[1]
+        return game
 
     def play(self, card):
+        self.card_counts[card.index] -= 1
+        self.version += 1
         if not self.play_area.play(card):
             self.fuse -= 1
             self.discard_pile.append(card)
@@ -36,6 +100,8 @@ class Hanabi:
             return self.draw()
 
     def discard(self, card):
+        self.card_counts[card.index] -= 1
+        self.version += 1
         self.discard_pile.append(card)
         self.time += 1
         if self.end_trigger:
@@ -63,11 +129,23 @@ class Hanabi:
                 if discard_count == 1:
                     rare_card_list.append(card)
 
-        for card in self.play_area.played_cards():
-            if card in rare_card_list:
-                rare_card_list.remove(card)
+        played_mask = self.play_area.played_mask()
+        return [card for card in rare_card_list if not card.bit & played_mask]
 
-        return rare_card_list
+    def rare_mask(self):
+        """Bitmask of get_rare_cards, recomputed only after a play or discard."""
+        if self._rare_version == self.version:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            self._rare_mask = card_mask(self.get_rare_cards())
+            self._rare_version = self.version
+        return self._rare_mask
+
+    def cache_stats(self):
+        """Hits and misses of the rarity cache and the play area's playability cache."""
+        return {'rare': (self.cache_hits, self.cache_misses),
+                'playable': (self.play_area.cache_hits, self.play_area.cache_misses)}
 
     def draw(self):
         if self.deck.is_empty():
@@ -76,8 +154,9 @@ class Hanabi:
         else:
             return self.deck.draw()
 
-    def give_info(self, giver, info):
-        recipient = giver.partner
+    def give_info(self, giver, info, recipient=None):
+        if recipient is None:
+            recipient = giver.partner
         recipient.receive_info(info)
         self.time -= 1
         if self.end_trigger:
@@ -87,36 +166,104 @@ class Hanabi:
         current_player = self.player1
         while not self.blown_up and self.turns_after_trigger > 0:
             current_player.perform_turn()
+            self.turns += 1
             current_player = current_player.partner
+        if self.recording is not None:
+            self.recording.end_game(self.play_area.get_score(), self.blown_up)
+        return self.play_area.get_score(), self.blown_up
+
+    def steps(self):
+        """Plays the game one move at a time for an external driver.
+
+        A generator that yields the player to move and expects the Move it is to
+        make to be sent back. Once the game is over it returns (score, blown_up),
+        which the driver finds on StopIteration.value. A driver may simply stop
+        sending moves to abandon the game.
+        """
+        current_player = self.player1
+        while not self.blown_up and self.turns_after_trigger > 0:
+            move = yield current_player
+            if self.recording is not None:
+                self.recording.record_move(move)
+            move.make_move()
+            self.turns += 1
+            current_player = current_player.partner
+        if self.recording is not None:
+            self.recording.end_game(self.play_area.get_score(), self.blown_up)
         return self.play_area.get_score(), self.blown_up
 
 
 class Player:
-    def __init__(self, starting_hand, game, move_search):
+    """A seat at the table. partner is the next player to act, so following
+    partner from any player visits every other player once before coming back."""
+    __slots__ = ('game', 'timestamp', 'hand', 'hand_counts', 'move_search', 'partner', 'seat')
+
+    def __init__(self, starting_hand, game, move_search, seat=0):
         self.game = game
+        self.seat = seat
         self.timestamp = 0
         self.hand = []
+        self.hand_counts = empty_count_matrix()
         self.move_search = move_search
         self.partner = None
         for card in starting_hand:
             self._add_to_hand(card)
 
+    def clone(self, game):
+        player = Player.__new__(Player)
+        player.game = game
+        player.seat = self.seat
+        player.timestamp = self.timestamp
+        player.hand = [card_in_hand.clone() for card_in_hand in self.hand]
+        player.hand_counts = list(self.hand_counts)
+        player.move_search = self.move_search
+        player.partner = None
+        return player
+
     def _add_to_hand(self, card):
         self.timestamp += 1
+        self.hand_counts[card.index] += 1
+        self.game.held_counts[card.index] += 1
         self.hand.append(CardInHand(card, self.timestamp))
 
+    def _remove_from_hand(self, position):
+        card_in_hand = self.hand.pop(position)
+        card = card_in_hand.card
+        self.hand_counts[card.index] -= 1
+        self.game.held_counts[card.index] -= 1
+        return card_in_hand
+
+    def unseen_counts(self):
+        """Counts of each card this player cannot see, indexed by Card.index.
+
+        These are the cards that are neither played, discarded nor in another
+        player's hand; cards in this player's own hand are included since it cannot
+        see them. The cost does not depend on the number of players.
+        """
+        return [count - held + own for count, held, own
+                in zip(self.game.card_counts, self.game.held_counts, self.hand_counts)]
+
+    def others(self):
+        """The other players in turn order, starting with partner."""
+        player = self.partner
+        while player is not self:
+            yield player
+            player = player.partner
+
     def perform_turn(self):
         move = self.move_search.get_best_move(self)
+        if self.game.recording is not None:
+            self.game.recording.record_move(move)
         move.make_move()
 
     def play(self, position):
-        card_in_hand = self.hand.pop(position)
+        card_in_hand = self._remove_from_hand(position)
         drawn_card = self.game.play(card_in_hand.card)
         if drawn_card:
             self._add_to_hand(drawn_card)
 
     def discard(self, position):
-        card_in_hand = self.hand.pop(position)
+        card_in_hand = self._remove_from_hand(position)
         drawn_card = self.game.discard(card_in_hand.card)
         if drawn_card:
             self._add_to_hand(drawn_card)
@@ -124,6 +271,10 @@ class Player:
     def give_info(self, info):
         self.game.give_info(self, info)
 
+    def give_info_to(self, hint):
+        recipient, info = hint
+        self.game.give_info(self, info, recipient)
+
     def receive_info(self, info):
         if isinstance(info, Colour):
             for card_in_hand in self.hand:
@@ -134,6 +285,9 @@ class Player:
 
 
 class CardInHand:
+    __slots__ = ('card', 'possible_colours', 'possible_numbers', 'colour', 'number', 'timestamp',
+                 'knowledge')
+
     def __init__(self, card, timestamp):
         self.card = card
         self.possible_colours = list(Colour)
@@ -141,20 +295,38 @@ class CardInHand:
         self.colour = None
         self.number = None
         self.timestamp = timestamp
+        # possible_colours and possible_numbers as a 10 bit mask: bit colour - 1
+        # for each colour and bit number + 4 for each number.
+        self.knowledge = 0b1111111111
+
+    def clone(self):
+        card_in_hand = CardInHand.__new__(CardInHand)
+        card_in_hand.card = self.card
+        card_in_hand.possible_colours = list(self.possible_colours)
+        card_in_hand.possible_numbers = list(self.possible_numbers)
+        card_in_hand.colour = self.colour
+        card_in_hand.number = self.number
+        card_in_hand.timestamp = self.timestamp
+        card_in_hand.knowledge = self.knowledge
+        return card_in_hand
 
     def learn_colour(self, colour):
         if self.card.colour == colour:
             self.possible_colours = [colour]
             self.colour = colour
+            self.knowledge = self.knowledge & 0b1111100000 | 1 << colour.value - 1
         elif colour in self.possible_colours:
             self.possible_colours.remove(colour)
+            self.knowledge &= ~(1 << colour.value - 1)
 
     def learn_number(self, number):
         if self.card.number == number:
             self.possible_numbers = [number]
             self.number = number
+            self.knowledge = self.knowledge & 0b0000011111 | 1 << number + 4
         elif number in self.possible_numbers:
             self.possible_numbers.remove(number)
+            self.knowledge &= ~(1 << number + 4)
 
 
 class Colour(Enum):
@@ -166,92 +338,148 @@ class Colour(Enum):
 
 
 class Card:
-    def __init__(self, colour, number):
-        self.colour = colour
-        self.number = number
+    """A card face. Cards are interned, so there is exactly one instance per colour
+    and number and equality and hashing are plain identity.
+
+    index is the card's small integer encoding, (colour - 1) * 5 + (number - 1),
+    and bit is 1 << index for building bitmasks of card faces.
+    """
+    __slots__ = ('colour', 'number', 'index', 'bit')
+    _interned = {}
+
+    def __new__(cls, colour, number):
+        card = cls._interned.get((colour, number))
+        if card is None:
+            card = object.__new__(cls)
+            card.colour = colour
+            card.number = number
+            card.index = (colour.value - 1) * 5 + number - 1
+            card.bit = 1 << card.index
+            cls._interned[colour, number] = card
+        return card
+
+    def __reduce__(self):
+        return Card, (self.colour, self.number)
 
     def __str__(self):
         return '{} {}'.format(self.colour.name, self.number)
 
-    def __eq__(self, other):
-        return self.colour == other.colour and self.number == other.number
 
-    def __hash__(self):
-        return self.colour.value * 10 + self.number
+class PlayArea:
+    """The fireworks, held as the height of each colour's pile in Colour order.
 
+    Plays, the score and the masks are O(1). The card lists below are built
+    from the heights for callers that want them.
+    """
 
-class PlayArea:
     def __init__(self):
-        self.played = {Colour.white: [],
-                       Colour.yellow: [],
-                       Colour.green: [],
-                       Colour.blue: [],
-                       Colour.red: []}
+        self.heights = [0] * 5
+        self.score = 0
+        self.version = 0
+        self._cache_version = -1
+        self._playable_mask = 0
+        self._future_playable_mask = 0
+        self._played_mask = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def clone(self):
+        play_area = PlayArea.__new__(PlayArea)
+        play_area.__dict__.update(self.__dict__)
+        play_area.heights = list(self.heights)
+        return play_area
+
+    @property
+    def played(self):
+        """The cards played in each colour, lowest first."""
+        return {colour: list(UNIQUE_CARDS[colour.value - 1][:height])
+                for colour, height in zip(Colour, self.heights)}
 
     def play(self, card):
-        suit = self.played[card.colour]
-        if not suit:
-            if card.number == 1:
-                suit.append(card)
-                return True
-            else:
-                return False
+        row = card.index // 5
+        if self.heights[row] != card.number - 1:
+            return False
+        self.heights[row] = card.number
+        self.score += 1
+        self.version += 1
+        return True
+
+    def _refresh_cache(self):
+        if self._cache_version == self.version:
+            self.cache_hits += 1
         else:
-            if suit[-1].number == card.number - 1:
-                suit.append(card)
-                return True
-            else:
-                return False
+            self.cache_misses += 1
+            playable_mask = 0
+            future_playable_mask = 0
+            played_mask = 0
+            for row, height in enumerate(self.heights):
+                playable_mask |= PLAYABLE_BITS[row][height]
+                future_playable_mask |= FUTURE_PLAYABLE_BITS[row][height]
+                played_mask |= PLAYED_BITS[row][height]
+            self._playable_mask = playable_mask
+            self._future_playable_mask = future_playable_mask
+            self._played_mask = played_mask
+            self._cache_version = self.version
+
+    def playable_mask(self):
+        """Bitmask of playable_cards, recomputed only after a successful play."""
+        self._refresh_cache()
+        return self._playable_mask
+
+    def future_playable_mask(self):
+        """Bitmask of future_playable_cards, recomputed only after a successful play."""
+        self._refresh_cache()
+        return self._future_playable_mask
+
+    def played_mask(self):
+        """Bitmask of played_cards, recomputed only after a successful play."""
+        self._refresh_cache()
+        return self._played_mask
 
     def get_score(self):
-        score = 0
-        for suit in self.played.values():
-            if suit:
-                score += suit[-1].number
-        return score
+        return self.score
 
     def playable_cards(self):
-        playable = []
-        for colour, values in self.played.items():
-            if not values:
-                playable.append(Card(colour, 1))
-            elif values[-1].number != 5:
-                playable.append(Card(colour, values[-1].number + 1))
-        return playable
+        return [row[height] for row, height in zip(UNIQUE_CARDS, self.heights) if height != 5]
 
     def future_playable_cards(self):
         playable = []
-        for colour, values in self.played.items():
-            if not values:
-                playable.append(Card(colour, 1))
-            elif values[-1].number != 5:
-                for value in range(values[-1].number, 5):
-                    playable.append(Card(colour, value))
+        for row, height in zip(UNIQUE_CARDS, self.heights):
+            if not height:
+                playable.append(row[0])
+            elif height != 5:
+                # From the top card played, as this has always counted it.
+                playable.extend(row[height - 1:4])
         return playable
 
     def discardable_cards(self):
-        discardable = []
-        for colour, values in self.played.items():
-            for value in values:
-                discardable.append(Card(colour, value))
-        return discardable
+        return self.played_cards()
 
     def played_cards(self):
         played = []
-        for suit in self.played.values():
-            for card in suit:
-                played.append(card)
+        for row, height in zip(UNIQUE_CARDS, self.heights):
+            played.extend(row[:height])
         return played
 
 
 class Deck:
-    def __init__(self, deck = None):
-        if not deck:
+    """The draw pile. Without a deck, a shuffled one is dealt from rng, a
+    numpy Generator, or from the global numpy.random state if rng is None."""
+
+    def __init__(self, deck = None, rng=None):
+        if not deck and rng is not None:
+            self.deck = shuffled_deck(rng)
+        elif not deck:
             self.deck = deque(HANABI_CARD_SET)
             random.shuffle(self.deck)
         else:
             self.deck = deck
 
+    def clone(self):
+        deck = Deck.__new__(Deck)
+        deck.deck = deque(self.deck)
+        return deck
+
     def is_empty(self):
         return len(self.deck) == 0
 
@@ -271,10 +499,237 @@ class PlayCriteria(Enum):
     probabilistic = 2
 
 
+class ProbabilityCache:
+    """A bounded memo of calc_percentages results.
+
+    Keys are built from the card's knowledge mask, the unseen card counts and
+    the board masks, which together decide the probabilities exactly, so a hit
+    returns the very tuple the uncached path would compute. Once maxsize keys
+    are stored, eviction drops the least recently used key ('lru') or the
+    oldest inserted key ('fifo').
+    """
+
+    def __init__(self, maxsize=1 << 16, eviction='lru'):
+        if eviction not in ('lru', 'fifo'):
+            raise ValueError('eviction must be lru or fifo, not {}'.format(eviction))
+        self.maxsize = maxsize
+        self.eviction = eviction
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        probabilities = self.entries.get(key)
+        if probabilities is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.eviction == 'lru':
+                self.entries.move_to_end(key)
+        return probabilities
+
+    def put(self, key, probabilities):
+        self.entries[key] = probabilities
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def counts(self):
+        return self.hits, self.misses
+
+    def add_counts(self, counts):
+        """Adds hits and misses counted elsewhere, such as by a worker's copy."""
+        hits, misses = counts
+        self.hits += hits
+        self.misses += misses
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+
+class SearchProfile:
+    """Call counts and cumulative times of MoveSearch's decision points, plus a
+    count of which selector produced each chosen move."""
+
+    def __init__(self):
+        self.calls = {}
+        self.times = {}
+        self.branches = {}
+
+    def record(self, name, elapsed):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.times[name] = self.times.get(name, 0) + elapsed
+
+    def timed(self, name, method):
+        def timed_method(*args):
+            start = perf_counter()
+            result = method(*args)
+            self.record(name, perf_counter() - start)
+            return result
+        return timed_method
+
+    def profile_move(self, search, player):
+        start = perf_counter()
+        move, branch = search.choose_move(player)
+        self.record('get_best_move', perf_counter() - start)
+        self.branches[branch] = self.branches.get(branch, 0) + 1
+        return move
+
+    def merge(self, other):
+        for name, calls in other.calls.items():
+            self.calls[name] = self.calls.get(name, 0) + calls
+            self.times[name] = self.times.get(name, 0) + other.times[name]
+        for branch, count in other.branches.items():
+            self.branches[branch] = self.branches.get(branch, 0) + count
+
+    def print_table(self):
+        print('\tMethod | Calls | Total s | Mean us')
+        for name in sorted(self.calls, key=self.times.get, reverse=True):
+            calls = self.calls[name]
+            print('\t{} | {} | {:.3f} | {:.1f}'.format(name, calls, self.times[name],
+                                                      self.times[name] / calls * 1e6))
+        print('\tMove chosen by | Count')
+        for branch, count in sorted(self.branches.items(), key=lambda item: -item[1]):
+            print('\t{} | {}'.format(branch, count))
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of numbers by Welford's method."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0
+        self.m2 = 0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0
+
+    def interval(self, z=1.96):
+        """The z-score confidence interval on the mean."""
+        half_width = z * sqrt(self.variance() / self.n) if self.n else 0
+        return self.mean - half_width, self.mean + half_width
+
+
+class ScoreComparison:
+    """Streaming results of several strategies on common decks.
+
+    Every strategy has its total and best score over the games it did not blow
+    up and its count of blown up games, as every tournament runner prints and
+    returns them. It also has a histogram of scores 0 to 25 and the running
+    mean and variance of its score, with a blown up game scoring 0. Every pair
+    of strategies has the running mean and variance of their per-deck score
+    difference, which gives a much tighter confidence interval than comparing
+    the two means. Memory does not grow with the number of games.
+    """
+
+    def __init__(self, comparisons):
+        self.n_games = 0
+        self.totals = [0] * comparisons
+        self.maxes = [0] * comparisons
+        self.games_failed = [0] * comparisons
+        self.histograms = [[0] * (MAX_SCORE + 1) for _ in range(comparisons)]
+        self.scores = [RunningStats() for _ in range(comparisons)]
+        self.differences = {(i, j): RunningStats()
+                            for i in range(comparisons) for j in range(i + 1, comparisons)}
+
+    def add_game(self, results):
+        """Adds one deck's (score, blown_up) result for every strategy."""
+        self.n_games += 1
+        for i, (score, fail) in enumerate(results):
+            if fail:
+                self.games_failed[i] += 1
+            else:
+                self.totals[i] += score
+                if score > self.maxes[i]:
+                    self.maxes[i] = score
+        scores = [0 if fail else score for score, fail in results]
+        for i, score in enumerate(scores):
+            self.histograms[i][score] += 1
+            self.scores[i].add(score)
+        for (i, j), difference in self.differences.items():
+            difference.add(scores[i] - scores[j])
+
+    def significant(self, z=2.58):
+        """Whether the interval on every pairwise difference excludes zero."""
+        for difference in self.differences.values():
+            low, high = difference.interval(z)
+            if low <= 0 <= high:
+                return False
+        return True
+
+    def results(self):
+        return self.totals, self.maxes, self.games_failed
+
+    def state(self):
+        return {'n_games': self.n_games,
+                'totals': self.totals,
+                'maxes': self.maxes,
+                'games_failed': self.games_failed,
+                'histograms': self.histograms,
+                'scores': [vars(stats) for stats in self.scores],
+                'differences': [[i, j, vars(stats)] for (i, j), stats in self.differences.items()]}
+
+    @classmethod
+    def from_state(cls, state):
+        comparison = cls(len(state['histograms']))
+        comparison.n_games = state['n_games']
+        comparison.totals = state['totals']
+        comparison.maxes = state['maxes']
+        comparison.games_failed = state['games_failed']
+        comparison.histograms = state['histograms']
+        for stats, values in zip(comparison.scores, state['scores']):
+            vars(stats).update(values)
+        for i, j, values in state['differences']:
+            vars(comparison.differences[i, j]).update(values)
+        return comparison
+
+    def print_results(self, searches, z=1.96):
+        """Prints each search's average, best score and failure rate, then the
+        table of confidence intervals."""
+        for i, search in enumerate(searches):
+            print(search)
+            print('\tAvg | Max | Failure Rate')
+            print('\t', end='')
+            print(self.totals[i] / (self.n_games - self.games_failed[i]), end=' | ')
+            print(self.maxes[i], end=' | ')
+            print(self.games_failed[i] / self.n_games)
+            if search.probability_cache is not None:
+                print('\tProbability cache hit rate: {:.3f}'.format(
+                    search.probability_cache.hit_rate()))
+            if search.profile is not None:
+                search.profile.print_table()
+        self.print_table(searches, z)
+
+    def print_table(self, searches, z=1.96):
+        print('Mean with failures as 0 | Std | CI at z = {}'.format(z))
+        for search, stats in zip(searches, self.scores):
+            low, high = stats.interval(z)
+            print('\t{:.3f} | {:.3f} | {:.3f} to {:.3f} | {}'.format(
+                stats.mean, sqrt(stats.variance()), low, high, search))
+        if self.differences:
+            print('Paired difference | CI at z = {}'.format(z))
+        for (i, j), stats in self.differences.items():
+            low, high = stats.interval(z)
+            print('\t{} - {}: {:.3f} | {:.3f} to {:.3f}'.format(i, j, stats.mean, low, high))
+
+
+PROFILED_METHODS = ('get_explicit_play', 'get_probabilistic_play', 'get_best_info',
+                    'oldest_discard', 'least_playable_discard',
+                    'least_future_playable_discard', 'least_rare_discard',
+                    'calc_percentages')
+
+
 class MoveSearch:
     def __init__(self, discard_criteria, play_criteria,
                  play_value, future_value, rare_value, other_value,
-                 play_threshold=.75, sudden_death_threshold=.90):
+                 play_threshold=.75, sudden_death_threshold=.90, probability_cache=None,
+                 exact_probabilities=False):
         self.discard_criteria = discard_criteria
         self.play_criteria = play_criteria
         self.play_value = play_value
@@ -283,78 +738,164 @@ class MoveSearch:
         self.other_value = other_value
         self.play_threshold = play_threshold
         self.sudden_death_threshold = sudden_death_threshold
+        self.probability_cache = probability_cache
+        self.exact_probabilities = exact_probabilities
+        # Values of hints by the masks get_best_info reduces them to; they only
+        # depend on the weights above, so the table is filled in as hints are seen.
+        self.hint_values = {}
+        self.profile = None
+
+    def __getstate__(self):
+        state = {name: value for name, value in self.__dict__.items()
+                 if name not in PROFILED_METHODS}
+        state['profile'] = self.profile is not None
+        return state
+
+    def __setstate__(self, state):
+        profiling = state.pop('profile', False)
+        self.__dict__.update(state)
+        self.profile = None
+        if profiling:
+            self.enable_profiling()
+
+    def enable_profiling(self):
+        """Starts timing get_best_move and the helpers in PROFILED_METHODS.
+
+        The helpers are wrapped on this instance only, so a search that is not
+        being profiled pays nothing beyond one attribute check per move. An
+        unpickled copy of a profiled search starts with a fresh SearchProfile.
+        """
+        self.profile = SearchProfile()
+        for name in PROFILED_METHODS:
+            setattr(self, name, self.profile.timed(name, getattr(self, name)))
+        return self.profile
+
+    def disable_profiling(self):
+        for name in PROFILED_METHODS:
+            self.__dict__.pop(name, None)
+        profile = self.profile
+        self.profile = None
+        return profile
 
     def __str__(self):
-        return ' '.join([str(self.play_criteria.name), str(self.discard_criteria.name),
+        name = ' '.join([str(self.play_criteria.name), str(self.discard_criteria.name),
                         str(self.play_value), str(self.future_value), str(self.other_value), str(self.rare_value),
                         str(self.play_threshold), str(self.sudden_death_threshold)])
+        if self.exact_probabilities:
+            name += ' exact'
+        return name
 
     def get_best_move(self, player):
+        if self.profile is not None:
+            return self.profile.profile_move(self, player)
+        return self.choose_move(player)[0]
+
+    def choose_move(self, player):
+        """The best move for player and the name of the selector that produced it."""
         partner = player.partner
         game = player.game
-        if self.play_criteria == PlayCriteria.explicit:
-            best_move = self.get_explicit_play(player, game.play_area)
-        else:
-            best_move = self.get_probabilistic_play(player, partner, game)
+        best_move, branch = self.get_play(player, partner, game)
         if not best_move and game.time > 0:
             best_move = self.get_best_info(player, partner, game)
+            branch = 'get_best_info'
         if not best_move:
-            if self.discard_criteria == DiscardCriteria.oldest:
-                best_move = self.oldest_discard(player)
-            elif self.discard_criteria == DiscardCriteria.playability:
-                best_move = self.least_playable_discard(player, partner, game)
-            elif self.discard_criteria == DiscardCriteria.future_playability:
-                best_move = self.least_future_playable_discard(player, partner, game)
-            else:
-                best_move = self.least_rare_discard(player, partner, game)
-        return best_move
+            best_move, branch = self.get_discard(player, partner, game)
+        return best_move, branch
+
+    def get_play(self, player, partner, game):
+        """The play the play criteria picks, or None, and the selector's name."""
+        if self.play_criteria == PlayCriteria.explicit:
+            return self.get_explicit_play(player, game.play_area), 'get_explicit_play'
+        return self.get_probabilistic_play(player, partner, game), 'get_probabilistic_play'
+
+    def get_discard(self, player, partner, game):
+        """The discard the discard criteria picks and the selector's name."""
+        if self.discard_criteria == DiscardCriteria.oldest:
+            return self.oldest_discard(player), 'oldest_discard'
+        elif self.discard_criteria == DiscardCriteria.playability:
+            return self.least_playable_discard(player, partner, game), 'least_playable_discard'
+        elif self.discard_criteria == DiscardCriteria.future_playability:
+            return (self.least_future_playable_discard(player, partner, game),
+                    'least_future_playable_discard')
+        return self.least_rare_discard(player, partner, game), 'least_rare_discard'
 
     def get_best_info(self, player, partner, game):
+        """The hint that touches the most valuable unknown colours or numbers.
+
+        Each recipient's hand is reduced to bitmasks over hand positions: one per
+        hint for the cards it would tell something new, and one per card class for
+        the rare, playable and future playable cards. A hint's value only depends
+        on those masks, so it is looked up in hint_values and worked out once per
+        search. Ties go to the first recipient in turn order, then to colours
+        before numbers, in INFO_ORDER.
+        """
         best_move = None
-        future_playable_cards = game.play_area.future_playable_cards()
-        playable_cards = game.play_area.playable_cards()
-        rare_cards = game.get_rare_cards()
-        playable_info = {Colour.white: 0,
-                         Colour.yellow: 0,
-                         Colour.green: 0,
-                         Colour.blue: 0,
-                         Colour.red: 0,
-                         1: 0,
-                         2: 0,
-                         3: 0,
-                         4: 0,
-                         5: 0}
-        partner_hand = partner.hand
-        for card_in_hand in partner_hand:
-            if not card_in_hand.colour:
-                if card_in_hand.card in rare_cards:
-                    playable_info[card_in_hand.card.colour] += self.rare_value
-                if card_in_hand.card in playable_cards:
-                    playable_info[card_in_hand.card.colour] += self.play_value
-                elif card_in_hand.card in future_playable_cards:
-                    playable_info[card_in_hand.card.colour] += self.future_value
-                else:
-                    playable_info[card_in_hand.card.colour] += self.other_value
-            if not card_in_hand.number:
-                if card_in_hand.card in rare_cards:
-                    playable_info[card_in_hand.card.number] += self.rare_value
-                if card_in_hand.card in playable_cards:
-                    playable_info[card_in_hand.card.number] += self.play_value
-                elif card_in_hand.card in future_playable_cards:
-                    playable_info[card_in_hand.card.number] += self.future_value
-                else:
-                    playable_info[card_in_hand.card.number] += self.other_value
-
+        future_playable_mask = game.play_area.future_playable_mask()
+        playable_mask = game.play_area.playable_mask()
+        rare_mask = game.rare_mask()
+        best_info = None
+        best_recipient = None
         best_value = 0
-        for info, value in playable_info.items():
-            if value > best_value:
-                best_value = value
-                best_move = Move(player.give_info, info)
-
+        for recipient in player.others():
+            hinted = [0] * 10
+            rare = 0
+            playable = 0
+            future_playable = 0
+            for i, card_in_hand in enumerate(recipient.hand):
+                card = card_in_hand.card
+                position = 1 << i
+                if not card_in_hand.colour:
+                    hinted[card.colour.value - 1] |= position
+                if not card_in_hand.number:
+                    hinted[card.number + 4] |= position
+                if card.bit & rare_mask:
+                    rare |= position
+                if card.bit & playable_mask:
+                    playable |= position
+                elif card.bit & future_playable_mask:
+                    future_playable |= position
+
+            hint_values = self.hint_values
+            for hint, cards in enumerate(hinted):
+                if not cards:
+                    continue
+                key = (cards, cards & rare, cards & playable, cards & future_playable)
+                value = hint_values.get(key)
+                if value is None:
+                    value = self.hint_value(*key)
+                    hint_values[key] = value
+                if value > best_value:
+                    best_value = value
+                    best_info = INFO_ORDER[hint]
+                    best_recipient = recipient
+
+        if best_recipient is partner:
+            best_move = Move(player.give_info, best_info)
+        elif best_recipient is not None:
+            best_move = Move(player.give_info_to, (best_recipient, best_info))
         return best_move
 
+    def hint_value(self, cards, rare, playable, future_playable):
+        """The value of hinting the hand positions in cards, summed position by
+        position so fractional weights round exactly as they always have."""
+        value = 0
+        position = 1
+        while position <= cards:
+            if cards & position:
+                if rare & position:
+                    value += self.rare_value
+                if playable & position:
+                    value += self.play_value
+                elif future_playable & position:
+                    value += self.future_value
+                else:
+                    value += self.other_value
+            position <<= 1
+        return value
+
     def get_probabilistic_play(self, player, partner, game):
         best_move = None
+        best_position = None
         best_prob = 0
         if game.fuse > 1:
             threshold = self.play_threshold
@@ -362,109 +903,176 @@ class MoveSearch:
             threshold = self.sudden_death_threshold
 
         for i, card_in_hand in enumerate(player.hand):
-            prob, _, _ = self.calc_percentages(card_in_hand, player.hand, partner.hand,
-                                         game.play_area, game, game.discard_pile)
+            prob, _, _ = self.calc_percentages(card_in_hand, player, game)
             if prob >= threshold and prob > best_prob:
                 best_prob = prob
-                best_move = Move(player.play, i)
+                best_position = i
 
+        if best_position is not None:
+            best_move = Move(player.play, best_position)
         return best_move
 
     def get_explicit_play(self, player, play_area):
         best_move = None
-        playable_cards = play_area.playable_cards()
+        best_position = None
+        playable_mask = play_area.playable_mask()
         for i, card_in_hand in enumerate(player.hand):
-            if card_in_hand.colour and card_in_hand.number and card_in_hand.card in playable_cards:
-                best_move = Move(player.play, i)
+            if card_in_hand.colour and card_in_hand.number and card_in_hand.card.bit & playable_mask:
+                best_position = i
 
+        if best_position is not None:
+            best_move = Move(player.play, best_position)
         return best_move
 
     def oldest_discard(self, player):
         oldest = 50
-        best_move = None
+        best_position = None
         for i, card_in_hand in enumerate(player.hand):
             if card_in_hand.timestamp < oldest:
                 oldest = card_in_hand.timestamp
-                best_move = Move(player.discard, i)
-        assert best_move
-        return best_move
+                best_position = i
+        assert best_position is not None
+        return Move(player.discard, best_position)
 
     def least_playable_discard(self, player, partner, game):
-        best_move = None
+        best_position = None
         worst_prob = 2
         for i, card_in_hand in enumerate(player.hand):
-            prob, _, _ = self.calc_percentages(card_in_hand, player.hand, partner.hand,
-                                         game.play_area, game, game.discard_pile)
+            prob, _, _ = self.calc_percentages(card_in_hand, player, game)
             if prob <= worst_prob:
                 worst_prob = prob
-                best_move = Move(player.discard, i)
+                best_position = i
 
-        assert best_move
-        return best_move
+        assert best_position is not None
+        return Move(player.discard, best_position)
 
     def least_future_playable_discard(self, player, partner, game):
-        best_move = None
+        best_position = None
         worst_prob = 2
         for i, card_in_hand in enumerate(player.hand):
-            _, prob, _ = self.calc_percentages(card_in_hand, player.hand, partner.hand,
-                                            game.play_area, game, game.discard_pile)
+            _, prob, _ = self.calc_percentages(card_in_hand, player, game)
             if prob <= worst_prob:
                 worst_prob = prob
-                best_move = Move(player.discard, i)
+                best_position = i
 
-        assert best_move
-        return best_move
+        assert best_position is not None
+        return Move(player.discard, best_position)
 
     def least_rare_discard(self, player, partner, game):
-        best_move = None
+        best_position = None
         worst_prob = 2
         for i, card_in_hand in enumerate(player.hand):
-            _, _, prob = self.calc_percentages(card_in_hand, player.hand, partner.hand,
-                                            game.play_area, game, game.discard_pile)
+            _, _, prob = self.calc_percentages(card_in_hand, player, game)
             if prob <= worst_prob:
                 worst_prob = prob
-                best_move = Move(player.discard, i)
+                best_position = i
 
-        assert best_move
-        return best_move
+        assert best_position is not None
+        return Move(player.discard, best_position)
 
-    def calc_percentages(self, given_card_in_hand, player_hand, partner_hand, play_area, game, discard_pile):
-        possible_cards = list(HANABI_CARD_SET)
-        for card_in_hand in partner_hand:
-            possible_cards.remove(card_in_hand.card)
-        for card_in_hand in player_hand:
+    def calc_percentages(self, given_card_in_hand, player, game):
+        if self.exact_probabilities:
+            return self.calc_exact_percentages(given_card_in_hand, player, game)
+        counts = player.unseen_counts()
+        for card_in_hand in player.hand:
             if not card_in_hand == given_card_in_hand and card_in_hand.colour and card_in_hand.number:
-                possible_cards.remove(card_in_hand.card)
-        for card in discard_pile:
-            possible_cards.remove(card)
-        for suit in play_area.played.values():
-            for card in suit:
-                possible_cards.remove(card)
-        possible_cards = list(filter(lambda card: card.colour in given_card_in_hand.possible_colours,
-                                     possible_cards))
-        possible_cards = list(filter(lambda card: card.number in given_card_in_hand.possible_numbers,
-                                     possible_cards))
-        n = len(possible_cards)
-        playable_cards = play_area.playable_cards()
-        future_playable_cards = play_area.future_playable_cards()
-        rare_cards = game.get_rare_cards()
-
-        playable_probability = 0
-        future_playable_probability = 0
-        rare_card_probability = 0
-        for card in possible_cards:
-            if card in playable_cards:
-                playable_probability += 1 / n
-            if card in future_playable_cards:
-                future_playable_probability += 1 / n
-            if card in rare_cards:
-                rare_card_probability += 1 / n
-
-        future_playable_probability = min(1, future_playable_probability)
+                counts[card_in_hand.card.index] -= 1
+        playable_mask = game.play_area.playable_mask()
+        future_playable_mask = game.play_area.future_playable_mask()
+        rare_mask = game.rare_mask()
+
+        cache = self.probability_cache
+        if cache is None:
+            return self.count_probabilities(given_card_in_hand, counts, playable_mask,
+                                            future_playable_mask, rare_mask)
+        key = (given_card_in_hand.knowledge, bytes(counts), playable_mask, future_playable_mask,
+               rare_mask)
+        probabilities = cache.get(key)
+        if probabilities is None:
+            probabilities = self.count_probabilities(given_card_in_hand, counts, playable_mask,
+                                                     future_playable_mask, rare_mask)
+            cache.put(key, probabilities)
+        return probabilities
+
+    def calc_exact_percentages(self, given_card_in_hand, player, game):
+        """calc_percentages over every deal of player's whole hand that fits what
+        it knows about each of its cards, rather than one card at a time."""
+        counts = player.unseen_counts()
+        knowledges = tuple(card_in_hand.knowledge for card_in_hand in player.hand)
+        position = player.hand.index(given_card_in_hand)
+        playable_mask = game.play_area.playable_mask()
+        future_playable_mask = game.play_area.future_playable_mask()
+        rare_mask = game.rare_mask()
+
+        cache = self.probability_cache
+        if cache is not None:
+            key = (knowledges, position, bytes(counts), playable_mask, future_playable_mask,
+                   rare_mask)
+            probabilities = cache.get(key)
+            if probabilities is not None:
+                return probabilities
+        weights, total = hand_type_weights(knowledges, position, counts)
+        playable_weight = 0
+        future_playable_weight = 0
+        rare_weight = 0
+        for index, weight in enumerate(weights):
+            if weight:
+                bit = 1 << index
+                if bit & playable_mask:
+                    playable_weight += weight
+                if bit & future_playable_mask:
+                    future_playable_weight += weight
+                if bit & rare_mask:
+                    rare_weight += weight
+        probabilities = (playable_weight / total, min(1, future_playable_weight / total),
+                         rare_weight / total)
+        if cache is not None:
+            cache.put(key, probabilities)
+        return probabilities
+
+    def count_probabilities(self, given_card_in_hand, counts, playable_mask, future_playable_mask,
+                            rare_mask):
+        n, playable_count, future_playable_count, rare_card_count = class_counts(
+            given_card_in_hand, counts, playable_mask, future_playable_mask, rare_mask)
+
+        # Probabilities are looked up as repeated sums of 1 / n rather than divided
+        # out, so they come out exactly as they did when summed card by card.
+        sums = PROBABILITY_SUMS[n]
+        playable_probability = sums[playable_count]
+        future_playable_probability = min(1, sums[future_playable_count])
+        rare_card_probability = sums[rare_card_count]
 
         return playable_probability, future_playable_probability, rare_card_probability
 
+
+def class_counts(given_card_in_hand, counts, playable_mask, future_playable_mask, rare_mask):
+    """How many of counts the card could be, and how many of those are playable,
+    future playable and rare. These decide calc_percentages."""
+    n = 0
+    playable_count = 0
+    future_playable_count = 0
+    rare_card_count = 0
+    for colour in given_card_in_hand.possible_colours:
+        row_index = (colour.value - 1) * 5 - 1
+        for number in given_card_in_hand.possible_numbers:
+            index = row_index + number
+            count = counts[index]
+            if not count:
+                continue
+            n += count
+            bit = 1 << index
+            if bit & playable_mask:
+                playable_count += count
+            if bit & future_playable_mask:
+                future_playable_count += count
+            if bit & rare_mask:
+                rare_card_count += count
+    return n, playable_count, future_playable_count, rare_card_count
+
+
 class Move:
+    __slots__ = ('move', 'arg')
+
     def __init__(self, move, arg):
         self.move = move
         self.arg = arg
@@ -549,32 +1157,283 @@ HANABI_UNIQUE_CARD_SET = (Card(Colour.white, 1),
                    Card(Colour.red, 4),
                    Card(Colour.red, 5))
 
+UNIQUE_CARDS = [HANABI_UNIQUE_CARD_SET[5 * colour:5 * colour + 5] for colour in range(5)]
+
+# Every hint in the order get_best_info breaks ties: colours, then numbers.
+INFO_ORDER = tuple(Colour) + (1, 2, 3, 4, 5)
+
+
+# The Card.index of every card face a 10 bit CardInHand.knowledge mask allows.
+KNOWLEDGE_INDICES = [tuple((colour - 1) * 5 + number - 1
+                           for colour in range(1, 6) if knowledge >> colour - 1 & 1
+                           for number in range(1, 6) if knowledge >> number + 4 & 1)
+                     for knowledge in range(1 << 10)]
+
+
+def hand_type_weights(knowledges, position, counts):
+    """How many deals of a hand fit the knowledge masks of all its cards, in
+    total and with the card at position being each card face.
+
+    counts are the cards the hand is dealt from, by Card.index. Returns the
+    weights by Card.index and their total, as exact integers. Faces allowed by
+    exactly the same hand positions are interchangeable, so they are pooled into
+    one class and the deals are counted over classes with memoized recursion.
+    """
+    allowed_by = [0] * 25
+    for i, knowledge in enumerate(knowledges):
+        for index in KNOWLEDGE_INDICES[knowledge]:
+            allowed_by[index] |= 1 << i
+    pooled = {}
+    for index, count in enumerate(counts):
+        if count and allowed_by[index]:
+            pooled[allowed_by[index]] = pooled.get(allowed_by[index], 0) + count
+    classes = list(pooled)
+    others = [1 << i for i in range(len(knowledges)) if i != position]
+    memo = {}
+
+    def deals(k, remaining):
+        if k == len(others):
+            return 1
+        key = (k, remaining)
+        total = memo.get(key)
+        if total is None:
+            total = 0
+            for c, count in enumerate(remaining):
+                if count and classes[c] & others[k]:
+                    total += count * deals(k + 1, remaining[:c] + (count - 1,) + remaining[c + 1:])
+            memo[key] = total
+        return total
+
+    start = tuple(pooled[allowed] for allowed in classes)
+    class_deals = {}
+    for c, count in enumerate(start):
+        if count and classes[c] >> position & 1:
+            class_deals[classes[c]] = deals(0, start[:c] + (count - 1,) + start[c + 1:])
+    weights = [count * class_deals.get(allowed_by[index], 0) for index, count in enumerate(counts)]
+    return weights, sum(weights)
+
+
+def enumerated_hand_type_weights(knowledges, position, counts):
+    """hand_type_weights by enumerating every ordered deal of the hand from
+    counts, for checking it on small hands and counts."""
+    cards = [index for index, count in enumerate(counts) for _ in range(count)]
+    weights = [0] * 25
+    for deal in permutations(cards, len(knowledges)):
+        if all(index in KNOWLEDGE_INDICES[knowledge] for index, knowledge in zip(deal, knowledges)):
+            weights[deal[position]] += 1
+    return weights, sum(weights)
+
+
+def check_hand_type_weights(n_trials=200, seed=0):
+    """Compares hand_type_weights with enumerated_hand_type_weights on n_trials
+    random hands of up to three cards, dealt from up to two of each card face.
+    Returns the (knowledges, position, counts) of every trial that differed."""
+    rng = random.default_rng(seed)
+    failed = []
+    for _ in range(n_trials):
+        counts = [int(count) for count in rng.integers(0, 3, 25)]
+        knowledges = tuple(int(rng.integers(1 << 10)) | 1 << int(rng.integers(5))
+                           | 1 << int(rng.integers(5, 10))
+                           for _ in range(rng.integers(1, 4)))
+        position = int(rng.integers(len(knowledges)))
+        if (hand_type_weights(knowledges, position, counts)
+                != enumerated_hand_type_weights(knowledges, position, counts)):
+            failed.append((knowledges, position, counts))
+    return failed
+
+
+def _repeated_sums(n):
+    sums = [0]
+    for _ in range(n):
+        sums.append(sums[-1] + 1 / n)
+    return sums
+
+PROBABILITY_SUMS = [[0]] + [_repeated_sums(n) for n in range(1, len(HANABI_CARD_SET) + 1)]
+
+
+def empty_count_matrix():
+    return [0] * 25
+
+
+def full_count_matrix():
+    counts = empty_count_matrix()
+    for card in HANABI_CARD_SET:
+        counts[card.index] += 1
+    return counts
+
+
+def game_rng(seed, game_index):
+    """The random stream of game game_index in a run with master seed seed.
+
+    Each game's stream is spawned from the master seed by its index alone, so
+    game i gets the same deck in any process, batch or resumed run.
+    """
+    return random.default_rng(random.SeedSequence(seed, spawn_key=(game_index,)))
+
+
+def shuffled_deck(rng):
+    return deque(HANABI_CARD_SET[i] for i in rng.permutation(len(HANABI_CARD_SET)))
+
+
+def game_deck(seed, game_index):
+    return shuffled_deck(game_rng(seed, game_index))
+
+
+def new_master_seed():
+    return random.SeedSequence().entropy
+
+
+def card_mask(cards):
+    mask = 0
+    for card in cards:
+        mask |= card.bit
+    return mask
+
+
+# Bitmasks of what PlayArea's card lists hold for one colour, by the height of
+# its pile.
+PLAYABLE_BITS = [[card_mask(row[height:height + 1]) for height in range(6)] for row in UNIQUE_CARDS]
+FUTURE_PLAYABLE_BITS = [[card_mask(row[height - 1:4] if height else row[:1])
+                         for height in range(6)] for row in UNIQUE_CARDS]
+PLAYED_BITS = [[card_mask(row[:height]) for height in range(6)] for row in UNIQUE_CARDS]
 
-def compare_move_searches(searches, n_games):
+
+def compare_move_searches(searches, n_games, profile=False, recorder=None, n_players=2, seed=None,
+                          first_game=0, comparison=None, stop_z=None, min_games=100):
+    """Plays every search on the same n_games decks and prints how they did.
+
+    Game i is dealt game_deck(seed, i), so a run can be split up or picked up
+    again from first_game and still play the same decks. Without a seed a fresh
+    master seed is drawn. Scores are also added to comparison, a new
+    ScoreComparison if none is given. With stop_z, the run ends early once
+    min_games have been played and every pairwise difference is significant at
+    that z. The results printed and returned cover every game in comparison.
+    """
+    if seed is None:
+        seed = new_master_seed()
     comparisons = len(searches)
-    totals = [0] * comparisons
-    maxes = [0] * comparisons
-    games_failed = [0] * comparisons
-    for _ in range(n_games):
-        deck = deque(HANABI_CARD_SET)
-        random.shuffle(deck)
+    if comparison is None:
+        comparison = ScoreComparison(comparisons)
+    if profile:
+        for search in searches:
+            search.enable_profiling()
+    for game_index in range(first_game, first_game + n_games):
+        deck = game_deck(seed, game_index)
         decks = [deque(deck) for _ in range(comparisons)]
-        games = [Hanabi(decks[i], searches[i]) for i in range(comparisons)]
-        score_fails = [game.play_game() for game in games]
-        for i, (score, fail) in enumerate(score_fails):
-            if fail:
-                games_failed[i] += 1
-            else:
-                totals[i] += score
-                if score > maxes[i]:
-                    maxes[i] = score
-    for i in range(comparisons):
-        print(searches[i])
-        print('\tAvg | Max | Failure Rate')
-        print('\t', end='')
-        print(totals[i] / (n_games - games_failed[i]), end=' | ')
-        print(maxes[i], end=' | ')
-        print(games_failed[i] / n_games)
+        games = [Hanabi(decks[i], searches[i], recorder, n_players) for i in range(comparisons)]
+        comparison.add_game([game.play_game() for game in games])
+        if stop_z is not None and game_index - first_game + 1 >= min_games \
+                and comparison.significant(stop_z):
+            break
+    comparison.print_results(searches)
+    return comparison.results()
+
+
+def compare_move_searches_parallel(searches, n_games, seed=None, processes=None, chunksize=16,
+                                   profile=False, n_players=2, first_game=0, comparison=None):
+    """Plays the same tournament as compare_move_searches over a process pool.
+
+    Workers deal each game's deck themselves from its own game_rng stream, so
+    each strategy still plays exactly the same decks and the same seed always
+    gives the same results as compare_move_searches, regardless of how the
+    (game, strategy) pairs are scheduled across the workers. With profile, each
+    worker's SearchProfile is merged back into the profile of the search it played,
+    and the hits and misses of workers' probability caches are added to the cache
+    of the search they played, so the hit rates printed cover the whole run.
+    A game's results are held back until every strategy has played it and then
+    added to comparison, a new ScoreComparison if none is given.
+    """
+    if seed is None:
+        seed = new_master_seed()
+    comparisons = len(searches)
+    if profile:
+        for search in searches:
+            search.enable_profiling()
+    if comparison is None:
+        comparison = ScoreComparison(comparisons)
+    jobs = ((i, searches[i], seed, game_index, n_players)
+            for game_index in range(first_game, first_game + n_games) for i in range(comparisons))
+    with Pool(processes) as pool:
+        add_game = game_collector(comparison, comparisons)
+        for i, game_index, score, fail, job_profile, cache_counts in pool.imap_unordered(
+                _play_seeded_game, jobs, chunksize):
+            add_game(i, game_index, score, fail)
+            if job_profile is not None:
+                searches[i].profile.merge(job_profile)
+            if cache_counts is not None:
+                searches[i].probability_cache.add_counts(cache_counts)
+    comparison.print_results(searches)
+    return comparison.results()
+
+
+def _play_seeded_game(job):
+    i, search, seed, game_index, n_players = job
+    cache = search.probability_cache
+    start_counts = None if cache is None else cache.counts()
+    score, fail = Hanabi(game_deck(seed, game_index), search, n_players=n_players).play_game()
+    cache_counts = None if cache is None else cache_delta(cache, start_counts)
+    job_profile = None
+    if search.profile is not None:
+        # Jobs in one chunk share an unpickled search, so hand back only this
+        # game's profile and start the next job on a fresh one.
+        job_profile = search.disable_profiling()
+        search.enable_profiling()
+    return i, game_index, score, fail, job_profile, cache_counts
+
+
+def cache_delta(cache, start_counts):
+    """The hits and misses cache has counted since it had start_counts."""
+    return tuple(now - start for now, start in zip(cache.counts(), start_counts))
+
+
+def game_collector(comparison, comparisons):
+    """A function taking results in any order that adds each game to comparison
+    as soon as every strategy has played it."""
+    pending = {}
+
+    def add_game(i, game_index, score, fail):
+        results = pending.setdefault(game_index, [None] * comparisons)
+        results[i] = (score, fail)
+        if None not in results:
+            del pending[game_index]
+            comparison.add_game(results)
+    return add_game
+
+
+def decide_each(search, players):
+    return [search.get_best_move(player) for player in players]
+
+
+def play_games_together(games, decide=decide_each):
+    """Plays many games at once through Hanabi.steps and returns their
+    (score, blown_up) results in order.
+
+    Each round, the players waiting to move are grouped by move_search and
+    decide(search, players) is called once per group for a list of Moves, one
+    per player, so a strategy can evaluate a whole group in one batched call.
+    """
+    results = [None] * len(games)
+    steppers = [game.steps() for game in games]
+    waiting = {}
+    for i, stepper in enumerate(steppers):
+        _advance(steppers, results, waiting, i, None)
+    while waiting:
+        groups = waiting
+        waiting = {}
+        for search, group in groups.items():
+            moves = decide(search, [player for _, player in group])
+            for (i, _), move in zip(group, moves):
+                _advance(steppers, results, waiting, i, move)
+    return results
+
+
+def _advance(steppers, results, waiting, i, move):
+    try:
+        player = steppers[i].send(move)
+    except StopIteration as stop:
+        results[i] = stop.value
+    else:
+        waiting.setdefault(player.move_search, []).append((i, player))
 
 
 if __name__ == '__main__':
@@ -617,6 +1476,8 @@ if __name__ == '__main__':
     # print(games_failed_2 / n_games)
     # print(total2 / (n_games - games_failed_2))
     # print(max2)
+    failed = check_hand_type_weights()
+    print('{} hands differed from enumeration'.format(len(failed)))
     move_search1 = MoveSearch(DiscardCriteria.oldest, PlayCriteria.explicit,
                               1, 1, 0, 1)
     move_search2 = MoveSearch(DiscardCriteria.oldest, PlayCriteria.probabilistic,
@@ -0,0 +1,322 @@
+from itertools import product
+
+import numpy as np
+
+from hanabi import (HANABI_CARD_SET, PROBABILITY_SUMS, DiscardCriteria, Hanabi, MoveSearch,
+                    PlayCriteria, full_count_matrix, game_deck)
+
+HAND_SIZE = 5
+DECK_SIZE = len(HANABI_CARD_SET)
+CARD_COLOURS = np.arange(25) // 5
+CARD_RANKS = np.arange(25) % 5
+FULL_MASK = 0b11111
+
+# PROBABILITY_SUMS as a dense table, so the batch probabilities are the exact
+# floats the scalar engine produces and every threshold and tie breaks the same.
+SUMS_TABLE = np.zeros((DECK_SIZE + 1, DECK_SIZE + 1))
+for _n, _sums in enumerate(PROBABILITY_SUMS):
+    SUMS_TABLE[_n, :len(_sums)] = _sums
+
+
+def deck_to_indices(deck):
+    """Converts a deck of Cards, in deque order, to an array of Card.index values."""
+    return np.array([card.index for card in deck], dtype=np.int8)
+
+
+class HanabiBatch:
+    """Plays N two player games in lockstep with a single MoveSearch.
+
+    Every piece of game state is held as an array with a leading game axis, and
+    each step makes one move in every game that is still running. decks is an
+    (N, 50) array of Card.index values in the same order as the deque handed to
+    Hanabi, so drawing takes cards from the end. Scores match Hanabi.play_game
+    game for game on the same decks.
+    """
+
+    def __init__(self, decks, move_search):
+        if move_search.exact_probabilities:
+            raise ValueError('HanabiBatch only plays approximate probabilities')
+        decks = np.asarray(decks, dtype=np.int8)
+        n_games = len(decks)
+        self.move_search = move_search
+        self.n_games = n_games
+        self.games = np.arange(n_games)
+        self.deck = decks
+        self.deck_size = np.full(n_games, DECK_SIZE)
+        self.heights = np.zeros((n_games, 5), dtype=np.int8)
+        self.discard_counts = np.zeros((n_games, 25), dtype=np.int8)
+        self.card_counts = np.tile(np.array(full_count_matrix(), dtype=np.int8), (n_games, 1))
+        self.time = np.full(n_games, 8)
+        self.fuse = np.full(n_games, 3)
+        self.end_trigger = np.zeros(n_games, dtype=bool)
+        self.turns_after_trigger = np.full(n_games, 2)
+        self.blown_up = np.zeros(n_games, dtype=bool)
+        self.current = np.zeros(n_games, dtype=np.intp)
+
+        self.hands = np.full((n_games, 2, HAND_SIZE), -1, dtype=np.int8)
+        self.hand_size = np.zeros((n_games, 2), dtype=np.intp)
+        self.timestamps = np.zeros((n_games, 2, HAND_SIZE), dtype=np.int32)
+        self.clock = np.zeros((n_games, 2), dtype=np.int32)
+        self.possible_colours = np.zeros((n_games, 2, HAND_SIZE), dtype=np.uint8)
+        self.possible_numbers = np.zeros((n_games, 2, HAND_SIZE), dtype=np.uint8)
+        self.colour_known = np.zeros((n_games, 2, HAND_SIZE), dtype=bool)
+        self.number_known = np.zeros((n_games, 2, HAND_SIZE), dtype=bool)
+
+        for player in (0, 1):
+            for _ in range(HAND_SIZE):
+                cards = self.deck[self.games, self.deck_size - 1]
+                self.deck_size -= 1
+                self._add_to_hand(self.games, np.full(n_games, player), cards)
+
+    def play_games(self):
+        """Plays every game to completion and returns (scores, blown_up) arrays."""
+        while True:
+            active = np.flatnonzero(~self.blown_up & (self.turns_after_trigger > 0))
+            if not len(active):
+                break
+            self.step(active)
+        return self.heights.sum(axis=1), self.blown_up.copy()
+
+    def step(self, games):
+        """Makes the current player's move in each of the given games."""
+        search = self.move_search
+        player = self.current[games]
+        partner = 1 - player
+        cards = self.hands[games, player]
+        valid = np.arange(HAND_SIZE) < self.hand_size[games, player][:, None]
+        playable, future_playable, rare = self._card_classes(games)
+
+        probabilities = None
+        if search.play_criteria == PlayCriteria.explicit:
+            known = self.colour_known[games, player] & self.number_known[games, player] & valid
+            can_play = known & np.take_along_axis(playable, np.maximum(cards, 0).astype(np.intp), 1)
+            play_position = HAND_SIZE - 1 - np.argmax(can_play[:, ::-1], axis=1)
+            plays = can_play.any(axis=1)
+        else:
+            probabilities = self._calc_percentages(games, player, partner, valid,
+                                                   playable, future_playable, rare)
+            threshold = np.where(self.fuse[games] > 1, search.play_threshold,
+                                 search.sudden_death_threshold)
+            prob = probabilities[0]
+            eligible = valid & (prob >= threshold[:, None]) & (prob > 0)
+            ranked = np.where(eligible, prob, -1)
+            play_position = np.argmax(ranked, axis=1)
+            plays = eligible.any(axis=1)
+
+        info = np.full(len(games), -1)
+        can_inform = ~plays & (self.time[games] > 0)
+        if can_inform.any():
+            info[can_inform] = self._get_best_info(games[can_inform], partner[can_inform],
+                                                   playable[can_inform],
+                                                   future_playable[can_inform],
+                                                   rare[can_inform])
+        informs = info >= 0
+        discards = ~plays & ~informs
+        discard_position = np.zeros(len(games), dtype=np.intp)
+        if discards.any():
+            discard_position[discards] = self._get_discard(
+                games, player, partner, valid, playable, future_playable, rare,
+                probabilities, discards)
+
+        if plays.any():
+            self._play(games[plays], player[plays], play_position[plays])
+        if informs.any():
+            self._give_info(games[informs], partner[informs], info[informs])
+        if discards.any():
+            self._discard(games[discards], player[discards], discard_position[discards])
+        self.current[games] = partner
+
+    def _card_classes(self, games):
+        heights = self.heights[games][:, CARD_COLOURS]
+        ranks = CARD_RANKS[None, :]
+        playable = ranks == heights
+        future_playable = np.where(heights == 0, ranks == 0,
+                                   (heights < 5) & (ranks >= heights - 1) & (ranks <= 3))
+        discarded = self.discard_counts[games]
+        # Hanabi.get_rare_cards doubles its discard tally, so a 1 is never rare.
+        rare = np.where(ranks == 4, discarded == 0, (ranks > 0) & (discarded == 1))
+        rare &= ranks >= heights
+        return playable, future_playable, rare
+
+    def _calc_percentages(self, games, player, partner, valid, playable, future_playable, rare):
+        cards = self.hands[games, player]
+        one_hot = (cards[:, :, None] == np.arange(25)) & valid[:, :, None]
+        partner_valid = np.arange(HAND_SIZE) < self.hand_size[games, partner][:, None]
+        partner_cards = self.hands[games, partner]
+        partner_counts = ((partner_cards[:, :, None] == np.arange(25))
+                          & partner_valid[:, :, None]).sum(axis=1)
+        known = self.colour_known[games, player] & self.number_known[games, player] & valid
+        unseen = (self.card_counts[games].astype(np.int32) - partner_counts
+                  - (one_hot & known[:, :, None]).sum(axis=1))
+        unseen = unseen[:, None, :] + (one_hot & known[:, :, None])
+
+        colours = self.possible_colours[games, player][:, :, None] >> CARD_COLOURS
+        numbers = self.possible_numbers[games, player][:, :, None] >> CARD_RANKS
+        possible = (colours & numbers & 1).astype(bool) & valid[:, :, None]
+        counts = np.where(possible, unseen, 0)
+        n = counts.sum(axis=2)
+        n[~valid] = 1
+        play_prob = SUMS_TABLE[n, (counts * playable[:, None, :]).sum(axis=2)]
+        future_prob = np.minimum(1, SUMS_TABLE[n, (counts * future_playable[:, None, :]).sum(axis=2)])
+        rare_prob = SUMS_TABLE[n, (counts * rare[:, None, :]).sum(axis=2)]
+        return play_prob, future_prob, rare_prob
+
+    def _get_best_info(self, games, partner, playable, future_playable, rare):
+        search = self.move_search
+        rows = np.arange(len(games))
+        values = np.zeros((len(games), 10))
+        cards = self.hands[games, partner].astype(np.intp)
+        size = self.hand_size[games, partner]
+        colour_known = self.colour_known[games, partner]
+        number_known = self.number_known[games, partner]
+        for slot in range(HAND_SIZE):
+            card = np.maximum(cards[:, slot], 0)
+            in_hand = slot < size
+            is_rare = rare[rows, card]
+            value = np.where(playable[rows, card], search.play_value,
+                             np.where(future_playable[rows, card], search.future_value,
+                                      search.other_value))
+            for bucket, unknown in ((CARD_COLOURS[card], ~colour_known[:, slot]),
+                                    (5 + CARD_RANKS[card], ~number_known[:, slot])):
+                hinted = in_hand & unknown
+                values[rows, bucket] += np.where(hinted & is_rare, search.rare_value, 0)
+                values[rows, bucket] += np.where(hinted, value, 0)
+        best = np.argmax(values, axis=1)
+        return np.where(values[rows, best] > 0, best, -1)
+
+    def _get_discard(self, games, player, partner, valid, playable, future_playable, rare,
+                     probabilities, discards):
+        criteria = self.move_search.discard_criteria
+        if criteria == DiscardCriteria.oldest:
+            timestamps = np.where(valid, self.timestamps[games, player], np.iinfo(np.int32).max)
+            return np.argmin(timestamps[discards], axis=1)
+        if probabilities is None:
+            probabilities = self._calc_percentages(games, player, partner, valid,
+                                                   playable, future_playable, rare)
+        if criteria == DiscardCriteria.playability:
+            prob = probabilities[0]
+        elif criteria == DiscardCriteria.future_playability:
+            prob = probabilities[1]
+        else:
+            prob = probabilities[2]
+        prob = np.where(valid, prob, np.inf)[discards]
+        # Ties go to the last card in hand, as in MoveSearch's discard selectors.
+        return HAND_SIZE - 1 - np.argmin(prob[:, ::-1], axis=1)
+
+    def _add_to_hand(self, games, player, cards):
+        slot = self.hand_size[games, player]
+        self.clock[games, player] += 1
+        self.hands[games, player, slot] = cards
+        self.timestamps[games, player, slot] = self.clock[games, player]
+        self.possible_colours[games, player, slot] = FULL_MASK
+        self.possible_numbers[games, player, slot] = FULL_MASK
+        self.colour_known[games, player, slot] = False
+        self.number_known[games, player, slot] = False
+        self.hand_size[games, player] += 1
+
+    def _remove_from_hand(self, games, player, position):
+        slots = np.arange(HAND_SIZE)
+        source = np.minimum(slots + (slots >= position[:, None]), HAND_SIZE - 1)
+        cards = self.hands[games, player, position]
+        for array in (self.hands, self.timestamps, self.possible_colours,
+                      self.possible_numbers, self.colour_known, self.number_known):
+            hand = array[games, player]
+            array[games, player] = np.take_along_axis(hand, source, 1)
+        self.hand_size[games, player] -= 1
+        self.hands[games, player, self.hand_size[games, player]] = -1
+        return cards.astype(np.intp)
+
+    def _play(self, games, player, position):
+        cards = self._remove_from_hand(games, player, position)
+        self.card_counts[games, cards] -= 1
+        colours = CARD_COLOURS[cards]
+        ranks = CARD_RANKS[cards]
+        success = self.heights[games, colours] == ranks
+        self.heights[games[success], colours[success]] += 1
+        fives = games[success & (ranks == 4)]
+        self.time[fives] = np.minimum(8, self.time[fives] + 1)
+        failed = games[~success]
+        self.fuse[failed] -= 1
+        self.discard_counts[failed, cards[~success]] += 1
+        self.blown_up[failed[self.fuse[failed] == 0]] = True
+        self._after_card_leaves_hand(games, player)
+
+    def _discard(self, games, player, position):
+        cards = self._remove_from_hand(games, player, position)
+        self.card_counts[games, cards] -= 1
+        self.discard_counts[games, cards] += 1
+        self.time[games] += 1
+        self._after_card_leaves_hand(games, player)
+
+    def _after_card_leaves_hand(self, games, player):
+        triggered = self.end_trigger[games]
+        self.turns_after_trigger[games[triggered]] -= 1
+        games = games[~triggered]
+        player = player[~triggered]
+        empty = self.deck_size[games] == 0
+        self.end_trigger[games[empty]] = True
+        games = games[~empty]
+        player = player[~empty]
+        cards = self.deck[games, self.deck_size[games] - 1]
+        self.deck_size[games] -= 1
+        self._add_to_hand(games, player, cards)
+
+    def _give_info(self, games, recipient, info):
+        valid = np.arange(HAND_SIZE) < self.hand_size[games, recipient][:, None]
+        cards = np.maximum(self.hands[games, recipient], 0)
+        for is_colour in (True, False):
+            chosen = info < 5 if is_colour else info >= 5
+            if not chosen.any():
+                continue
+            hinted_games = games[chosen]
+            hinted_recipient = recipient[chosen]
+            hinted = (info[chosen] % 5)[:, None]
+            if is_colour:
+                matches = CARD_COLOURS[cards[chosen]] == hinted
+                masks, known = self.possible_colours, self.colour_known
+            else:
+                matches = CARD_RANKS[cards[chosen]] == hinted
+                masks, known = self.possible_numbers, self.number_known
+            matches &= valid[chosen]
+            bit = (1 << hinted).astype(np.uint8)
+            mask = masks[hinted_games, hinted_recipient]
+            masks[hinted_games, hinted_recipient] = np.where(matches, bit, mask & ~bit)
+            known[hinted_games, hinted_recipient] |= matches
+        self.time[games] -= 1
+        triggered = games[self.end_trigger[games]]
+        self.turns_after_trigger[triggered] -= 1
+
+
+def play_games(decks, move_search):
+    """Plays every deck in decks with move_search and returns (scores, blown_up) arrays."""
+    return HanabiBatch(decks, move_search).play_games()
+
+
+# Weights covering the defaults, fractional weights and thresholds, and
+# negative weights, for check_against_scalar.
+CHECK_WEIGHTS = [(1, 1, 0, 1), (2, .5, 1.5, .3, .6, .8), (1, -1, 0, -2)]
+
+
+def check_against_scalar(n_games=300, seed=0):
+    """Plays game_deck(seed, i) for i below n_games with every combination of
+    criteria and CHECK_WEIGHTS, both in a batch and one game at a time with
+    Hanabi.play_game. Returns (search, games that differed) for each search."""
+    decks = np.array([deck_to_indices(game_deck(seed, i)) for i in range(n_games)])
+    results = []
+    for discard_criteria, play_criteria in product(DiscardCriteria, PlayCriteria):
+        for weights in CHECK_WEIGHTS:
+            search = MoveSearch(discard_criteria, play_criteria, *weights)
+            scores, blown_up = play_games(decks, search)
+            n_different = sum((int(scores[i]), bool(blown_up[i])) !=
+                              Hanabi(game_deck(seed, i), search).play_game()
+                              for i in range(n_games))
+            results.append((search, n_different))
+    return results
+
+
+if __name__ == '__main__':
+    n_failed = 0
+    for search, n_different in check_against_scalar():
+        print('{} | {}'.format(n_different, search))
+        n_failed += n_different > 0
+    print('{} searches differed from Hanabi.play_game'.format(n_failed))
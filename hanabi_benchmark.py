@@ -0,0 +1,178 @@
+import argparse
+import json
+import sys
+from functools import wraps
+from time import perf_counter
+
+import numpy as np
+
+from hanabi import DiscardCriteria, Hanabi, MoveSearch, PlayCriteria
+from hanabi_corpus import corpus_deck, open_corpus, seeded_decks
+
+TIMED_METHODS = ('get_best_move', 'calc_percentages', 'get_best_info')
+PERCENTILES = (50, 90, 99)
+
+
+def deck_corpus(n_games, seed, path=None):
+    """The first n_games decks of the corpus file at path, or else the decks
+    game_deck(seed, i) deals, as hanabi_corpus rows."""
+    if path is not None:
+        return np.asarray(open_corpus(path)[:n_games])
+    return seeded_decks(seed, 0, n_games)
+
+
+def _timed(method, samples):
+    @wraps(method)
+    def timed_method(*args):
+        start = perf_counter()
+        result = method(*args)
+        samples.append(perf_counter() - start)
+        return result
+    return timed_method
+
+
+def benchmark_search(search, corpus, latency_games):
+    """Throughput over the whole corpus and per-call latencies over its first
+    latency_games decks for one MoveSearch.
+
+    Latencies are measured in a separate pass with the methods in TIMED_METHODS
+    wrapped on the instance, so the timing wrappers do not slow the throughput pass.
+    """
+    turns = 0
+    start = perf_counter()
+    for i in range(len(corpus)):
+        game = Hanabi(corpus_deck(corpus, i), search)
+        game.play_game()
+        turns += game.turns
+    elapsed = perf_counter() - start
+
+    samples = {name: [] for name in TIMED_METHODS}
+    for name in TIMED_METHODS:
+        setattr(search, name, _timed(getattr(search, name), samples[name]))
+    try:
+        for i in range(min(latency_games, len(corpus))):
+            Hanabi(corpus_deck(corpus, i), search).play_game()
+    finally:
+        for name in TIMED_METHODS:
+            delattr(search, name)
+
+    latencies = {}
+    for name, times in samples.items():
+        if times:
+            values = np.percentile(np.array(times) * 1e6, PERCENTILES)
+            latencies[name] = dict(zip(['p{}_us'.format(p) for p in PERCENTILES], values.tolist()))
+            latencies[name]['calls'] = len(times)
+    return {'games': len(corpus),
+            'turns': turns,
+            'seconds': elapsed,
+            'games_per_second': len(corpus) / elapsed,
+            'turns_per_second': turns / elapsed,
+            'latency': latencies}
+
+
+def benchmark(searches, n_games=200, seed=0, latency_games=50, corpus_path=None):
+    """Benchmarks every search on the same decks, keyed by str(search): those
+    of the corpus file at corpus_path, or else game_deck(seed, i)."""
+    corpus = deck_corpus(n_games, seed, corpus_path)
+    return {'n_games': len(corpus),
+            'seed': seed,
+            'corpus': corpus_path,
+            'searches': {str(search): benchmark_search(search, corpus, latency_games)
+                         for search in searches}}
+
+
+def write_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_regressions(results, baseline, tolerance=0.1):
+    """Messages for every throughput drop or median latency rise beyond tolerance.
+
+    Only strategies present in both results are compared.
+    """
+    regressions = []
+    for name, result in results['searches'].items():
+        base = baseline['searches'].get(name)
+        if base is None:
+            continue
+        for rate in ('games_per_second', 'turns_per_second'):
+            if result[rate] < base[rate] * (1 - tolerance):
+                regressions.append('{}: {} fell from {:.1f} to {:.1f}'.format(
+                    name, rate, base[rate], result[rate]))
+        for method, latency in result['latency'].items():
+            base_latency = base['latency'].get(method)
+            if base_latency and latency['p50_us'] > base_latency['p50_us'] * (1 + tolerance):
+                regressions.append('{}: {} p50 rose from {:.1f}us to {:.1f}us'.format(
+                    name, method, base_latency['p50_us'], latency['p50_us']))
+    return regressions
+
+
+def print_results(results):
+    for name, result in results['searches'].items():
+        print(name)
+        print('\tGames/s | Turns/s')
+        print('\t{:.1f} | {:.1f}'.format(result['games_per_second'], result['turns_per_second']))
+        for method, latency in sorted(result['latency'].items()):
+            print('\t{}: {} calls, p50 {:.1f}us, p90 {:.1f}us, p99 {:.1f}us'.format(
+                method, latency['calls'], latency['p50_us'], latency['p90_us'], latency['p99_us']))
+
+
+def print_exact_cost(results):
+    """How much slower each exact probability search was than its approximate twin."""
+    for name, result in results['searches'].items():
+        base = results['searches'].get(name[:-len(' exact')])
+        if not name.endswith(' exact') or base is None:
+            continue
+        print(name)
+        print('\t{:.2f}x the time per game'.format(
+            base['games_per_second'] / result['games_per_second']))
+        latency = result['latency'].get('calc_percentages')
+        base_latency = base['latency'].get('calc_percentages')
+        if latency and base_latency:
+            print('\t{:.2f}x the calc_percentages p50'.format(
+                latency['p50_us'] / base_latency['p50_us']))
+
+
+DEFAULT_SEARCHES = [MoveSearch(discard_criteria, play_criteria, 1, 1, 0, 1)
+                    for play_criteria in PlayCriteria
+                    for discard_criteria in DiscardCriteria]
+EXACT_SEARCHES = [MoveSearch(discard_criteria, PlayCriteria.probabilistic, 1, 1, 0, 1,
+                             exact_probabilities=True)
+                  for discard_criteria in DiscardCriteria]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark MoveSearch engine speed.')
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--latency-games', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus', help='deck corpus file to play instead of the seeded decks')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='results file to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--exact', action='store_true',
+                        help='also time exact probabilities against the approximation')
+    args = parser.parse_args(argv)
+
+    searches = DEFAULT_SEARCHES + EXACT_SEARCHES if args.exact else DEFAULT_SEARCHES
+    results = benchmark(searches, args.games, args.seed, args.latency_games, args.corpus)
+    print_results(results)
+    if args.exact:
+        print_exact_cost(results)
+    write_results(results, args.output)
+    if args.baseline:
+        regressions = find_regressions(results, read_results(args.baseline), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
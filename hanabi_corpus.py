@@ -0,0 +1,105 @@
+"""Pre-generated corpora of shuffled decks stored as memory mapped arrays.
+
+A corpus is a .npy file holding an (n_decks, 50) uint8 array, one row of 50
+bytes per deck, giving the Card.index of every card in the order handed to
+Hanabi. Deck i of a corpus made with a seed is game_deck(seed, i), so a corpus
+plays exactly the decks compare_move_searches deals for that seed. Rows are in
+the layout hanabi_batch takes, so a slice of a corpus can be played there
+directly.
+"""
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+from hanabi import (HANABI_CARD_SET, HANABI_UNIQUE_CARD_SET, Hanabi, ScoreComparison,
+                    cache_delta, game_rng, new_master_seed)
+
+DECK_SIZE = len(HANABI_CARD_SET)
+CARD_SET_INDICES = np.array([card.index for card in HANABI_CARD_SET], dtype=np.uint8)
+
+
+def write_corpus(path, n_decks, seed=None, block_size=1 << 16):
+    """Writes n_decks decks dealt from seed to path, block_size decks at a time,
+    and returns the seed used."""
+    if seed is None:
+        seed = new_master_seed()
+    corpus = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(n_decks, DECK_SIZE))
+    for start in range(0, n_decks, block_size):
+        stop = min(n_decks, start + block_size)
+        corpus[start:stop] = seeded_decks(seed, start, stop)
+    corpus.flush()
+    del corpus
+    return seed
+
+
+def seeded_decks(seed, start, stop):
+    """Rows start to stop of the corpus written from seed, dealt without one:
+    the decks game_deck(seed, i) for i in that range."""
+    decks = [CARD_SET_INDICES[game_rng(seed, i).permutation(DECK_SIZE)] for i in range(start, stop)]
+    return np.array(decks, dtype=np.uint8).reshape(len(decks), DECK_SIZE)
+
+
+def open_corpus(path):
+    """The corpus at path as a read only memory mapped array; nothing is read
+    from disk until a deck is used."""
+    return np.load(path, mmap_mode='r')
+
+
+def corpus_deck(corpus, i):
+    return deque(HANABI_UNIQUE_CARD_SET[index] for index in corpus[i].tolist())
+
+
+def corpus_share(corpus, worker, n_workers):
+    """The contiguous slice of corpus that worker of n_workers should play."""
+    n_decks = len(corpus)
+    return corpus[n_decks * worker // n_workers:n_decks * (worker + 1) // n_workers]
+
+
+_worker_corpus = None
+_worker_searches = None
+
+
+def _open_worker(path, searches):
+    global _worker_corpus, _worker_searches
+    _worker_corpus = open_corpus(path)
+    _worker_searches = searches
+
+
+def _play_block(job):
+    start, stop, n_players = job
+    caches = [search.probability_cache for search in _worker_searches]
+    start_counts = [None if cache is None else cache.counts() for cache in caches]
+    results = [[Hanabi(corpus_deck(_worker_corpus, i), search, n_players=n_players).play_game()
+                for search in _worker_searches]
+               for i in range(start, stop)]
+    cache_counts = [None if cache is None else cache_delta(cache, counts)
+                    for cache, counts in zip(caches, start_counts)]
+    return start, results, cache_counts
+
+
+def compare_on_corpus(searches, path, n_games=None, first_game=0, processes=None, block_size=64,
+                      n_players=2, comparison=None):
+    """compare_move_searches_parallel over the decks of a corpus.
+
+    Every worker maps the corpus itself and is sent the searches once, so jobs
+    are only ranges of deck numbers and no deck is ever pickled. Plays n_games
+    decks from first_game, or the rest of the corpus. The hits and misses of the
+    workers' probability caches are added to the searches' own caches.
+    """
+    if n_games is None:
+        n_games = len(open_corpus(path)) - first_game
+    if comparison is None:
+        comparison = ScoreComparison(len(searches))
+    stop = first_game + n_games
+    jobs = ((start, min(stop, start + block_size), n_players)
+            for start in range(first_game, stop, block_size))
+    with Pool(processes, _open_worker, (path, searches)) as pool:
+        for _, results, cache_counts in pool.imap(_play_block, jobs):
+            for game_results in results:
+                comparison.add_game(game_results)
+            for search, counts in zip(searches, cache_counts):
+                if counts is not None:
+                    search.probability_cache.add_counts(counts)
+    comparison.print_results(searches)
+    return comparison.results()
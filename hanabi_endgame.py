@@ -0,0 +1,258 @@
+from time import perf_counter
+
+from hanabi import KNOWLEDGE_INDICES, Move, MoveSearch
+
+
+class OutOfTime(Exception):
+    pass
+
+
+class EndgameSearch(MoveSearch):
+    """A MoveSearch that solves the endgame once the deck is empty.
+
+    With no cards left to draw, the cards a player cannot see are exactly the
+    cards in its own hand, so the only chance left is which of its cards sits
+    where. Every arrangement of its hand that fits what it knows is equally
+    likely. Each candidate move is scored by its mean value over those
+    arrangements, searching every arrangement as if all cards were face up from
+    there on. That value is the best final score, with a blown up game scoring 0.
+
+    The search deepens one ply at a time until it reaches the end of the game or
+    runs out of time_budget seconds, and plays the best move of the deepest
+    finished pass. Before the deck runs out, or if not even one pass finishes,
+    the plain MoveSearch move is played. Solved positions are kept in a
+    transposition table keyed on state_key, shared by the moves of one game and
+    cleared when a new game starts or once it holds table_size entries.
+    """
+
+    def __init__(self, discard_criteria, play_criteria,
+                 play_value, future_value, rare_value, other_value,
+                 play_threshold=.75, sudden_death_threshold=.90, probability_cache=None,
+                 exact_probabilities=False, time_budget=.05, max_depth=16, table_size=1 << 18):
+        super().__init__(discard_criteria, play_criteria, play_value, future_value, rare_value,
+                         other_value, play_threshold, sudden_death_threshold, probability_cache,
+                         exact_probabilities)
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.table_size = table_size
+        self.table = {}
+        self.table_game = None
+        self.nodes = 0
+        self.deadline = 0
+
+    def __str__(self):
+        return 'endgame {} '.format(self.time_budget) + super().__str__()
+
+    def choose_move(self, player):
+        heuristic_move, branch = super().choose_move(player)
+        if not player.game.deck.is_empty():
+            return heuristic_move, branch
+        self.deadline = perf_counter() + self.time_budget
+        if self.table_game is not player.game or len(self.table) > self.table_size:
+            self.table.clear()
+            self.table_game = player.game
+        candidates = root_candidates(player, heuristic_move)
+        arrangements = hand_arrangements(player)
+        best = None
+        try:
+            for depth in range(1, self.max_depth + 1):
+                values, exact = self.rate_candidates(player, candidates, arrangements, depth)
+                best = max(range(len(candidates)), key=lambda i: (values[i], -i))
+                if exact:
+                    break
+        except OutOfTime:
+            pass
+        if best is None:
+            return heuristic_move, branch
+        return candidate_move(candidates[best], player, heuristic_move), 'endgame'
+
+    def rate_candidates(self, player, candidates, arrangements, depth):
+        """The mean value of every candidate over the arrangements of player's
+        hand, and whether all of them were searched to the end of the game."""
+        game = player.game
+        hands = [sorted_hand(other.hand) for other in game.players]
+        start = (tuple(game.play_area.heights), game.fuse, game.time, game.end_trigger,
+                 game.turns_after_trigger, player.seat)
+        totals = [0] * len(candidates)
+        exact = True
+        for arrangement in arrangements:
+            for i, candidate in enumerate(candidates):
+                state = root_child(start, hands, arrangement, candidate, len(game.players))
+                value, child_exact = self.solve(state, depth - 1)
+                totals[i] += value
+                exact = exact and child_exact
+        return [total / len(arrangements) for total in totals], exact
+
+    def solve(self, state, depth):
+        """(value, exact) of a face up state, exact being False if the search was
+        cut off at depth, in which case value is a lower bound."""
+        heights, fuse, time, end_trigger, turns, seat, hands = state
+        if fuse == 0:
+            return 0, True
+        score = sum(heights)
+        if end_trigger and turns <= 0:
+            return score, True
+        if depth == 0:
+            return score, False
+        key = state_key(state)
+        entry = self.table.get(key)
+        if entry is not None:
+            # An entry packs the value + 1 into its low five bits, then whether
+            # it is exact, then the depth it was searched to.
+            value, entry_exact, entry_depth = (entry & 31) - 1, entry >> 5 & 1, entry >> 6
+            if entry_exact or entry_depth >= depth:
+                return value, bool(entry_exact)
+        self.nodes += 1
+        if not self.nodes & 1023 and perf_counter() > self.deadline:
+            raise OutOfTime()
+
+        # Every play or discard before the trigger triggers it, so at most this
+        # many more cards can be played.
+        bound = min(25, score + turns + (0 if end_trigger else 1))
+        best = -1
+        exact = True
+        for child in children(state):
+            value, child_exact = self.solve(child, depth - 1)
+            exact = exact and child_exact
+            if value > best:
+                best = value
+                if best >= bound:
+                    exact = True
+                    break
+        self.table[key] = depth << 6 | exact << 5 | best + 1
+        return best, exact
+
+
+def state_key(state):
+    """A face up state packed into one int: three bits for each height, then
+    the fuse, time, end trigger, turns left and seat, then five bits for each
+    card of every hand, Card.index + 1 or 0 for no card."""
+    heights, fuse, time, end_trigger, turns, seat, hands = state
+    key = 0
+    for height in heights:
+        key = key << 3 | height
+    key = ((((key << 2 | fuse) << 4 | time) << 1 | end_trigger) << 3 | turns) << 3 | seat
+    for hand in hands:
+        for position in range(5):
+            key = key << 5 | (hand[position] + 1 if position < len(hand) else 0)
+    return key
+
+
+def sorted_hand(hand):
+    return tuple(sorted(card_in_hand.card.index for card_in_hand in hand))
+
+
+def hand_arrangements(player):
+    """Every way, as Card.index by hand position, the player's unseen cards can
+    fill its hand consistently with what it knows."""
+    counts = player.unseen_counts()
+    knowledges = [card_in_hand.knowledge for card_in_hand in player.hand]
+    arrangements = []
+
+    def arrange(prefix):
+        if len(prefix) == len(knowledges):
+            arrangements.append(tuple(prefix))
+            return
+        for index in KNOWLEDGE_INDICES[knowledges[len(prefix)]]:
+            if counts[index]:
+                counts[index] -= 1
+                prefix.append(index)
+                arrange(prefix)
+                prefix.pop()
+                counts[index] += 1
+    arrange([])
+    return arrangements
+
+
+def root_candidates(player, heuristic_move):
+    candidates = [('play', i) for i in range(len(player.hand))]
+    candidates.extend(('discard', i) for i in range(len(player.hand)))
+    if player.game.time > 0:
+        candidates.append(('info', None))
+    # The heuristic's own move goes first, so it wins ties.
+    kind = heuristic_move.move.__name__
+    first = ('info', None) if kind.startswith('give_info') else (kind, heuristic_move.arg)
+    candidates.remove(first)
+    return [first] + candidates
+
+
+def candidate_move(candidate, player, heuristic_move):
+    kind, position = candidate
+    if kind == 'play':
+        return Move(player.play, position)
+    if kind == 'discard':
+        return Move(player.discard, position)
+    if heuristic_move.move.__name__.startswith('give_info'):
+        return heuristic_move
+    # Any hint will do to pass the turn; this one always touches a card.
+    return Move(player.give_info, player.partner.hand[0].card.colour)
+
+
+def root_child(start, hands, arrangement, candidate, n_players):
+    heights, fuse, time, end_trigger, turns, seat = start
+    kind, position = candidate
+    if kind == 'info':
+        hand = tuple(sorted(arrangement))
+        return passed(heights, fuse, time, end_trigger, turns, seat, hands, hand, n_players)
+    card = arrangement[position]
+    hand = tuple(sorted(arrangement[:position] + arrangement[position + 1:]))
+    if kind == 'play':
+        return played(heights, fuse, time, end_trigger, turns, seat, hands, hand, card, n_players)
+    return discarded(heights, fuse, time, end_trigger, turns, seat, hands, hand, n_players)
+
+
+def children(state):
+    """Every state one move on from a face up state. Playing a card that does
+    not fit is left out, as discarding it instead is always at least as good."""
+    heights, fuse, time, end_trigger, turns, seat, hands = state
+    n_players = len(hands)
+    hand = hands[seat]
+    cards = sorted(set(hand))
+    rest = {}
+    for card in cards:
+        position = hand.index(card)
+        rest[card] = hand[:position] + hand[position + 1:]
+    for card in cards:
+        if heights[card // 5] == card % 5:
+            yield played(heights, fuse, time, end_trigger, turns, seat, hands, rest[card], card,
+                         n_players)
+    if time > 0:
+        yield passed(heights, fuse, time, end_trigger, turns, seat, hands, hand, n_players)
+    for card in cards:
+        yield discarded(heights, fuse, time, end_trigger, turns, seat, hands, rest[card], n_players)
+
+
+def _after_card(end_trigger, turns):
+    # The deck is empty, so the first card played or discarded triggers the end.
+    return True, turns - 1 if end_trigger else turns
+
+
+def _with_hand(hands, seat, hand):
+    return hands[:seat] + (hand,) + hands[seat + 1:]
+
+
+def played(heights, fuse, time, end_trigger, turns, seat, hands, hand, card, n_players):
+    row = card // 5
+    number = card % 5 + 1
+    if heights[row] == number - 1:
+        heights = heights[:row] + (number,) + heights[row + 1:]
+        if number == 5:
+            time = min(8, time + 1)
+    else:
+        fuse -= 1
+    end_trigger, turns = _after_card(end_trigger, turns)
+    return (heights, fuse, time, end_trigger, turns, (seat + 1) % n_players,
+            _with_hand(tuple(hands), seat, hand))
+
+
+def discarded(heights, fuse, time, end_trigger, turns, seat, hands, hand, n_players):
+    end_trigger, turns = _after_card(end_trigger, turns)
+    return (heights, fuse, time + 1, end_trigger, turns, (seat + 1) % n_players,
+            _with_hand(tuple(hands), seat, hand))
+
+
+def passed(heights, fuse, time, end_trigger, turns, seat, hands, hand, n_players):
+    if end_trigger:
+        turns -= 1
+    return (heights, fuse, time - 1, end_trigger, turns, (seat + 1) % n_players,
+            _with_hand(tuple(hands), seat, hand))
@@ -0,0 +1,212 @@
+import json
+import os
+from multiprocessing import Pool
+
+from hanabi import (Hanabi, ScoreComparison, _play_seeded_game, game_collector,
+                    game_deck, new_master_seed)
+from hanabi_log import decode_move, encode_move
+
+CHECKPOINT_FORMAT = 1
+
+
+class EvaluationJob:
+    """A long compare_move_searches run that survives being killed.
+
+    Games are played in blocks of checkpoint_every, and after each block the
+    job's ScoreComparison is written to path together with the index of the
+    next game. Running a job whose checkpoint already exists picks up at that
+    game, and since game i is always dealt game_deck(seed, i) the finished job
+    matches an uninterrupted run.
+    With stop_z, the job also ends after the first block at which min_games
+    have been played and every pairwise difference is significant at that z.
+
+    Checkpoints are written to a temporary file that then replaces path, so a
+    crash part way through a write leaves the previous checkpoint intact.
+    """
+
+    def __init__(self, searches, n_games, path, seed=None, n_players=2, checkpoint_every=1000,
+                 processes=1, chunksize=16, stop_z=None, min_games=100):
+        self.searches = searches
+        self.n_games = n_games
+        self.path = path
+        self.n_players = n_players
+        self.checkpoint_every = checkpoint_every
+        self.processes = processes
+        self.chunksize = chunksize
+        self.stop_z = stop_z
+        self.min_games = min_games
+        self.seed = new_master_seed() if seed is None else seed
+        self.next_game = 0
+        self.comparison = ScoreComparison(len(searches))
+        if os.path.exists(path):
+            self.load()
+
+    def names(self):
+        return [str(search) for search in self.searches]
+
+    def load(self):
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('format') != CHECKPOINT_FORMAT:
+            raise ValueError('{} is not a format {} checkpoint'.format(self.path, CHECKPOINT_FORMAT))
+        if state['searches'] != self.names() or state['n_players'] != self.n_players:
+            raise ValueError('{} is a checkpoint of a different job'.format(self.path))
+        self.seed = state['seed']
+        self.next_game = state['next_game']
+        self.comparison = ScoreComparison.from_state(state['comparison'])
+
+    def save(self):
+        state = {'format': CHECKPOINT_FORMAT,
+                 'searches': self.names(),
+                 'n_players': self.n_players,
+                 'seed': self.seed,
+                 'next_game': self.next_game,
+                 'comparison': self.comparison.state()}
+        write_atomic(self.path, json.dumps(state))
+
+    def is_done(self):
+        if self.stop_z is not None and self.next_game >= self.min_games \
+                and self.comparison.significant(self.stop_z):
+            return True
+        return self.next_game >= self.n_games
+
+    def run(self):
+        """Plays the remaining games, checkpointing after every block, and
+        prints and returns the totals, maxes and failure counts."""
+        pool = Pool(self.processes) if self.processes != 1 else None
+        try:
+            while not self.is_done():
+                block = range(self.next_game, min(self.n_games, self.next_game + self.checkpoint_every))
+                jobs = ((i, search, self.seed, game_index, self.n_players)
+                        for game_index in block for i, search in enumerate(self.searches))
+                if pool is None:
+                    results = map(_play_seeded_game, jobs)
+                else:
+                    results = pool.imap_unordered(_play_seeded_game, jobs, self.chunksize)
+                add_game = game_collector(self.comparison, len(self.searches))
+                for i, game_index, score, fail, _, cache_counts in results:
+                    add_game(i, game_index, score, fail)
+                    # Without a pool the searches' own caches did the counting.
+                    if pool is not None and cache_counts is not None:
+                        self.searches[i].probability_cache.add_counts(cache_counts)
+                self.next_game = block.stop
+                self.save()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.comparison.print_results(self.searches)
+        return self.comparison.results()
+
+
+def write_atomic(path, text):
+    """Replaces the contents of path with text in one step."""
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+class SharedProbabilities:
+    """calc_percentages results for the turn being decided, shared by every
+    search deciding it.
+
+    Nothing changes while the searches on a game pick their moves, so a card's
+    probabilities are worked out once per turn rather than once per search.
+    The searches are wrapped on the instance, as enable_profiling does, until
+    restore is called.
+    """
+
+    def __init__(self, searches):
+        self.results = {}
+        self.searches = searches
+        self.replaced = []
+        for search in searches:
+            self.replaced.append(search.__dict__.get('calc_percentages'))
+            search.calc_percentages = self.shared(search.calc_percentages,
+                                                  search.exact_probabilities)
+
+    def shared(self, calc_percentages, exact):
+        results = self.results
+
+        def shared_calc_percentages(card_in_hand, player, game):
+            key = (id(card_in_hand), exact)
+            probabilities = results.get(key)
+            if probabilities is None:
+                probabilities = calc_percentages(card_in_hand, player, game)
+                results[key] = probabilities
+            return probabilities
+        return shared_calc_percentages
+
+    def new_turn(self):
+        self.results.clear()
+
+    def restore(self):
+        # In reverse, so a search listed twice gets back its own method.
+        for search, replaced in reversed(list(zip(self.searches, self.replaced))):
+            if replaced is None:
+                del search.calc_percentages
+            else:
+                search.calc_percentages = replaced
+
+
+def play_shared(deck, searches, n_players=2, shared_probabilities=None):
+    """Plays every search on one deck, sharing the game while they agree.
+
+    All searches start on one game. Each turn every search still on a game
+    picks its move there, and searches that pick different moves are split
+    onto clones of the game, one per distinct move. Returns (score, blown_up)
+    for every search, the same as playing each game separately. Pass the
+    searches' SharedProbabilities to have it cleared between turns.
+    """
+    results = [None] * len(searches)
+    game = Hanabi(deck, None, n_players=n_players)
+    branches = [(game, game.player1, list(range(len(searches))))]
+    while branches:
+        game, player, members = branches.pop()
+        while not game.blown_up and game.turns_after_trigger > 0:
+            if shared_probabilities is not None:
+                shared_probabilities.new_turn()
+            groups = {}
+            for i in members:
+                code = encode_move(searches[i].get_best_move(player))
+                groups.setdefault(code, []).append(i)
+            codes = list(groups)
+            for code in codes[1:]:
+                branch = game.clone()
+                branch_player = branch.players[player.seat]
+                decode_move(code, branch_player).make_move()
+                branch.turns += 1
+                branches.append((branch, branch_player.partner, groups[code]))
+            members = groups[codes[0]]
+            decode_move(codes[0], player).make_move()
+            game.turns += 1
+            player = player.partner
+        for i in members:
+            results[i] = game.play_area.get_score(), game.blown_up
+    return results
+
+
+def compare_move_searches_shared(searches, n_games, seed=None, n_players=2, first_game=0,
+                                 comparison=None):
+    """compare_move_searches for many similar searches, playing each deck with
+    play_shared so turns on which they all agree are simulated only once.
+
+    The searches share their calc_percentages results through
+    SharedProbabilities for the run.
+    """
+    if seed is None:
+        seed = new_master_seed()
+    if comparison is None:
+        comparison = ScoreComparison(len(searches))
+    shared_probabilities = SharedProbabilities(searches)
+    try:
+        for game_index in range(first_game, first_game + n_games):
+            comparison.add_game(play_shared(game_deck(seed, game_index), searches, n_players,
+                                            shared_probabilities))
+    finally:
+        shared_probabilities.restore()
+    comparison.print_results(searches)
+    return comparison.results()
@@ -0,0 +1,163 @@
+"""Export of every decision made in self-play as columns of NumPy arrays.
+
+Passed to Hanabi as its recorder, a StateExporter adds one row per move: the
+state the moving player saw and the move it chose. Rows are fixed width, with
+hands padded to MAX_HAND_SIZE cards:
+
+    game                the exporter's running number of the game
+    turn                the move's turn number in the game
+    seat                the moving player's seat
+    knowledge           per own card, the 10 bit CardInHand.knowledge mask of
+                        possible_colours and possible_numbers, with bit 10 set
+                        if the colour was hinted directly and bit 11 if the
+                        number was; 0 for no card
+    partner_cards       per card in the partner's hand, Card.index + 1; 0 for
+                        no card
+    partner_knowledge   the partner's knowledge, as for knowledge
+    fireworks           the PlayArea heights
+    time, fuse          the clock and fuse tokens left
+    deck                the number of cards left to draw
+    move                the move chosen, as hanabi_log.encode_move
+    score, blown_up     how the game ended, as Hanabi.play_game returns it
+
+Rows are buffered in memory and written every shard_size rows to a compressed
+.npz shard holding one array per column, so memory use does not grow with the
+number of games exported. A game's rows are only added once it ends, so a
+shard never holds part of a game that was abandoned.
+"""
+import glob
+import os
+import struct
+
+import numpy as np
+
+from hanabi_log import encode_move
+
+MAX_HAND_SIZE = 5
+ROW = np.dtype([('game', '<u4'),
+                ('turn', 'u1'),
+                ('seat', 'u1'),
+                ('knowledge', '<u2', (MAX_HAND_SIZE,)),
+                ('partner_cards', 'u1', (MAX_HAND_SIZE,)),
+                ('partner_knowledge', '<u2', (MAX_HAND_SIZE,)),
+                ('fireworks', 'u1', (5,)),
+                ('time', 'u1'),
+                ('fuse', 'u1'),
+                ('deck', 'u1'),
+                ('move', 'u1'),
+                ('score', 'u1'),
+                ('blown_up', 'u1')])
+# The fields of ROW from turn to move, in its layout, packed as each move is made.
+MOVE_ROW = struct.Struct('<BB{0}H{0}B{0}H5BBBBB'.format(MAX_HAND_SIZE))
+MOVE_ROW_OFFSET = ROW.fields['turn'][1]
+
+
+def hand_knowledge(hand):
+    knowledge = [card_in_hand.knowledge | (card_in_hand.colour is not None) << 10
+                 | (card_in_hand.number is not None) << 11 for card_in_hand in hand]
+    return knowledge + [0] * (MAX_HAND_SIZE - len(knowledge))
+
+
+def move_row(move):
+    """The MOVE_ROW of move, made from the state before it is made."""
+    player = move.move.__self__
+    game = player.game
+    partner = player.partner
+    partner_cards = [card_in_hand.card.index + 1 for card_in_hand in partner.hand]
+    partner_cards += [0] * (MAX_HAND_SIZE - len(partner_cards))
+    return MOVE_ROW.pack(game.turns, player.seat, *hand_knowledge(player.hand), *partner_cards,
+                         *hand_knowledge(partner.hand), *game.play_area.heights, game.time,
+                         game.fuse, len(game.deck.deck), encode_move(move))
+
+
+class StateExporter:
+    """Exports the rows of every game it records to numbered shards in directory.
+
+    Exporting to a directory that already holds shards carries on after them,
+    numbering games on from the last one exported there. Any number of games
+    may be in progress on one exporter at once. close, or leaving a with block,
+    writes the rows still buffered as a last, smaller shard.
+    """
+
+    def __init__(self, directory, shard_size=1 << 16):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.rows = np.zeros(shard_size, dtype=ROW)
+        self.n_rows = 0
+        os.makedirs(directory, exist_ok=True)
+        shards = shard_paths(directory)
+        self.n_shards = len(shards)
+        self.n_games = 0
+        if shards:
+            with np.load(shards[-1]) as shard:
+                if len(shard['game']):
+                    self.n_games = int(shard['game'].max()) + 1
+
+    def start_game(self, deck, n_players=2, hand_size=None):
+        if hand_size is not None and hand_size > MAX_HAND_SIZE:
+            raise ValueError('hands of more than {} cards cannot be exported'.format(MAX_HAND_SIZE))
+        self.n_games += 1
+        return GameExport(self, self.n_games - 1)
+
+    def add_game(self, game_index, move_rows, score, blown_up):
+        n_moves = len(move_rows) // MOVE_ROW.size
+        game_rows = np.zeros(n_moves, dtype=ROW)
+        game_rows.view(np.uint8).reshape(n_moves, ROW.itemsize)[
+            :, MOVE_ROW_OFFSET:MOVE_ROW_OFFSET + MOVE_ROW.size] = \
+            np.frombuffer(move_rows, dtype=np.uint8).reshape(n_moves, MOVE_ROW.size)
+        game_rows['game'] = game_index
+        game_rows['score'] = score
+        game_rows['blown_up'] = blown_up
+        start = 0
+        while start < len(game_rows):
+            n = min(len(game_rows) - start, self.shard_size - self.n_rows)
+            self.rows[self.n_rows:self.n_rows + n] = game_rows[start:start + n]
+            self.n_rows += n
+            start += n
+            if self.n_rows == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if not self.n_rows:
+            return
+        rows = self.rows[:self.n_rows]
+        path = os.path.join(self.directory, 'shard-{:06d}.npz'.format(self.n_shards))
+        np.savez_compressed(path, **{name: rows[name] for name in ROW.names})
+        self.n_shards += 1
+        self.n_rows = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameExport:
+    """The rows of one game in progress, added to the exporter when it ends."""
+
+    def __init__(self, exporter, game_index):
+        self.exporter = exporter
+        self.game_index = game_index
+        self.move_rows = bytearray()
+
+    def record_move(self, move):
+        self.move_rows += move_row(move)
+
+    def end_game(self, score, blown_up):
+        self.exporter.add_game(self.game_index, self.move_rows, score, blown_up)
+
+
+def shard_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, 'shard-*.npz')))
+
+
+def read_shards(directory, columns=None):
+    """Yields each shard in directory in order as a dict of column arrays,
+    loading only the columns asked for."""
+    for path in shard_paths(directory):
+        with np.load(path) as shard:
+            yield {name: shard[name] for name in (columns or ROW.names)}
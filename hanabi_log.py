@@ -0,0 +1,220 @@
+"""Compact append-only binary logs of Hanabi games.
+
+A log file starts with MAGIC and holds one record per game:
+
+    deck      50 bytes, Card.index of every card in the order handed to Hanabi
+    score     1 byte
+    flags     1 byte: bit 0 set if the game blew up, bits 1-3 the number of
+              players minus 2 and bits 4-7 the hand size, 0 meaning the
+              default hand size for that many players
+    n_moves   2 bytes, little endian
+    moves     1 byte per move: PLAY | position, DISCARD | position or
+              INFO * seats | hint, where seats is how many seats after the
+              giver the recipient sits, and hint is colour - 1 for a colour and
+              number + 4 for a number
+
+Next to it, path + '.idx' holds the little endian uint64 offset of every
+record, so a reader can jump to any game without scanning the log.
+"""
+import mmap
+import os
+import struct
+from collections import deque
+
+import numpy as np
+
+from hanabi import HANABI_UNIQUE_CARD_SET, Colour, Hanabi, Move, default_hand_size
+
+MAGIC = b'HNBL\x01'
+RECORD_HEADER = struct.Struct('<50sBBH')
+PLAY = 0x00
+DISCARD = 0x10
+INFO = 0x20
+COLOURS = list(Colour)
+
+
+def encode_move(move):
+    kind = move.move.__name__
+    if kind == 'play':
+        return PLAY | move.arg
+    if kind == 'discard':
+        return DISCARD | move.arg
+    if kind == 'give_info':
+        seats, info = 1, move.arg
+    else:
+        recipient, info = move.arg
+        giver = move.move.__self__
+        seats = (recipient.seat - giver.seat) % len(giver.game.players)
+    if isinstance(info, Colour):
+        return INFO * seats | info.value - 1
+    return INFO * seats | info + 4
+
+
+def decode_move(code, player):
+    kind = code & 0xf0
+    arg = code & 0x0f
+    if kind == PLAY:
+        return Move(player.play, arg)
+    if kind == DISCARD:
+        return Move(player.discard, arg)
+    info = COLOURS[arg] if arg < 5 else arg - 4
+    if kind == INFO:
+        return Move(player.give_info, info)
+    recipient = player
+    for _ in range(kind // INFO):
+        recipient = recipient.partner
+    return Move(player.give_info_to, (recipient, info))
+
+
+class GameLogWriter:
+    """Records games to a log when passed to Hanabi as its recorder.
+
+    Each game is built up in memory and appended as one record when it ends;
+    writes go through large file buffers, so the game loop never waits on disk.
+    Any number of games may be in progress on one writer at once.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        new_log = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.log = open(path, 'ab', buffering=buffer_size)
+        self.index = open(path + '.idx', 'ab', buffering=buffer_size)
+        if new_log:
+            self.log.write(MAGIC)
+            self.index.truncate(0)
+        self.offset = self.log.tell()
+
+    def start_game(self, deck, n_players=2, hand_size=None):
+        flags = n_players - 2 << 1
+        if hand_size is not None and hand_size != default_hand_size(n_players):
+            flags |= hand_size << 4
+        return GameRecording(self, bytes(card.index for card in deck), flags)
+
+    def write_record(self, record):
+        self.log.write(record)
+        self.index.write(struct.pack('<Q', self.offset))
+        self.offset += len(record)
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameRecording:
+    """The moves of one game in progress, written to the log when the game ends."""
+
+    def __init__(self, writer, deck, flags):
+        self.writer = writer
+        self.deck = deck
+        self.flags = flags
+        self.moves = bytearray()
+
+    def record_move(self, move):
+        self.moves.append(encode_move(move))
+
+    def end_game(self, score, blown_up):
+        self.writer.write_record(
+            RECORD_HEADER.pack(self.deck, score, self.flags | blown_up, len(self.moves))
+            + self.moves)
+
+
+class GameRecord:
+    def __init__(self, deck, score, flags, moves):
+        self.deck = deck
+        self.score = score
+        self.blown_up = bool(flags & 1)
+        self.n_players = (flags >> 1 & 0b111) + 2
+        self.hand_size = flags >> 4 or default_hand_size(self.n_players)
+        self.moves = moves
+
+    def cards(self):
+        return deque(HANABI_UNIQUE_CARD_SET[index] for index in self.deck)
+
+    def replay(self):
+        """Plays the recorded moves through Hanabi and returns (score, blown_up)."""
+        return Hanabi(self.cards(), ReplaySearch(self.moves),
+                      n_players=self.n_players, hand_size=self.hand_size).play_game()
+
+
+class ReplaySearch:
+    """Stands in for a MoveSearch and makes the recorded moves in order."""
+
+    def __init__(self, moves):
+        self.moves = iter(moves)
+
+    def get_best_move(self, player):
+        return decode_move(next(self.moves), player)
+
+
+class GameLogReader:
+    """Random and sequential access to a game log through a memory map.
+
+    Records are only decoded when asked for. Records missing from the index are
+    found by scanning on from the last indexed one, and records cut short by a
+    crash are ignored.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a game log'.format(path))
+        index_path = path + '.idx'
+        offsets = np.zeros(0, dtype='<u8')
+        if os.path.exists(index_path) and os.path.getsize(index_path) >= 8:
+            offsets = np.memmap(index_path, dtype='<u8', mode='r',
+                                shape=(os.path.getsize(index_path) // 8,))
+            n_games = len(offsets)
+            while n_games and self._record_end(int(offsets[n_games - 1])) is None:
+                n_games -= 1
+            offsets = offsets[:n_games]
+        start = self._record_end(int(offsets[-1])) if len(offsets) else len(MAGIC)
+        unindexed = self._scan(start)
+        if unindexed:
+            offsets = np.concatenate([offsets, np.array(unindexed, dtype='<u8')])
+        self.offsets = offsets
+
+    def _record_end(self, offset):
+        if offset + RECORD_HEADER.size > len(self.data):
+            return None
+        n_moves = RECORD_HEADER.unpack_from(self.data, offset)[3]
+        end = offset + RECORD_HEADER.size + n_moves
+        return end if end <= len(self.data) else None
+
+    def _scan(self, offset):
+        offsets = []
+        while True:
+            end = self._record_end(offset)
+            if end is None:
+                return offsets
+            offsets.append(offset)
+            offset = end
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        offset = int(self.offsets[i])
+        deck, score, flags, n_moves = RECORD_HEADER.unpack_from(self.data, offset)
+        start = offset + RECORD_HEADER.size
+        return GameRecord(deck, score, flags, self.data[start:start + n_moves])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.offsets = None
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,209 @@
+from collections import deque
+from time import perf_counter
+
+from numpy import random
+
+from hanabi import HANABI_UNIQUE_CARD_SET, Colour, Move, MoveSearch, RunningStats, new_master_seed
+
+
+class LookaheadSearch(MoveSearch):
+    """A MoveSearch that looks a few plies ahead before it moves.
+
+    Each sample deals the player a hand consistent with what it knows about its
+    own cards, and a deck from the rest of the cards it cannot see. Every
+    candidate move is then made on a clone of that deal and followed by depth
+    plies of the plain MoveSearch heuristics, and scored by the score reached,
+    0 if the game blew up, less fuse_penalty for every fuse lost on the way.
+    The heuristic's own move is played unless, after at least min_samples
+    samples, some candidate beats it on the same deals by a paired difference
+    whose z-score confidence interval lies above zero; then the candidate with
+    the best mean difference is played.
+
+    Sampling stops after n_samples or time_budget seconds, whichever comes
+    first. The clock is checked before every ply of every rollout, so the budget
+    is overrun by at most one heuristic move, and only samples whose every
+    candidate was rolled out to the end count.
+
+    The samples for a move are drawn from a stream spawned from seed and
+    everything the player can see, so a seed gives the same moves however games
+    are split between processes.
+    """
+
+    def __init__(self, discard_criteria, play_criteria,
+                 play_value, future_value, rare_value, other_value,
+                 play_threshold=.75, sudden_death_threshold=.90, probability_cache=None,
+                 exact_probabilities=False, n_samples=20, depth=10, time_budget=.05, seed=None,
+                 fuse_penalty=5, min_samples=5, z=1.96):
+        super().__init__(discard_criteria, play_criteria, play_value, future_value,
+                         rare_value, other_value, play_threshold, sudden_death_threshold,
+                         probability_cache, exact_probabilities)
+        self.rollout_search = MoveSearch(discard_criteria, play_criteria, play_value,
+                                         future_value, rare_value, other_value,
+                                         play_threshold, sudden_death_threshold,
+                                         probability_cache, exact_probabilities)
+        self.n_samples = n_samples
+        self.depth = depth
+        self.time_budget = time_budget
+        self.seed = new_master_seed() if seed is None else seed
+        self.fuse_penalty = fuse_penalty
+        self.min_samples = min_samples
+        self.z = z
+
+    def __str__(self):
+        return 'lookahead {} {} {} '.format(self.n_samples, self.depth, self.time_budget) + \
+            super().__str__()
+
+    def choose_move(self, player):
+        deadline = perf_counter() + self.time_budget
+        heuristic_move, branch = self.rollout_search.choose_move(player)
+        candidates = [candidate_for(heuristic_move, player)]
+        candidates.extend(candidate for candidate in legal_candidates(player)
+                          if candidate != candidates[0])
+        rng = random.default_rng(random.SeedSequence(self.seed, spawn_key=view_key(player)))
+        differences = [RunningStats() for _ in candidates]
+        samples = 0
+        while samples < self.n_samples and perf_counter() < deadline:
+            deal = self.sample_deal(player, rng)
+            if deal is None:
+                break
+            values = []
+            for candidate in candidates:
+                value = self.rollout(deal, player.seat, candidate, deadline)
+                if value is None:
+                    break
+                values.append(value)
+            if len(values) < len(candidates):
+                break
+            for stats, value in zip(differences, values):
+                stats.add(value - values[0])
+            samples += 1
+        best = 0
+        if samples >= self.min_samples:
+            for i, stats in enumerate(differences):
+                if stats.interval(self.z)[0] > 0 and stats.mean > differences[best].mean:
+                    best = i
+        if not best:
+            return heuristic_move, branch
+        return move_for(candidates[best], player), 'lookahead'
+
+    def sample_deal(self, player, rng, attempts=20):
+        """A clone of player's game with player's hand and the deck redrawn from
+        the cards player cannot see, or None if no consistent hand was found."""
+        for _ in range(attempts):
+            pool = player.unseen_counts()
+            hand = []
+            for card_in_hand in player.hand:
+                weights = [count if card_in_hand.knowledge >> index // 5 & 1
+                           and card_in_hand.knowledge >> index % 5 + 5 & 1 else 0
+                           for index, count in enumerate(pool)]
+                total = sum(weights)
+                if not total:
+                    break
+                pick = int(rng.integers(total))
+                index = 0
+                while pick >= weights[index]:
+                    pick -= weights[index]
+                    index += 1
+                pool[index] -= 1
+                hand.append(HANABI_UNIQUE_CARD_SET[index])
+            else:
+                return self._deal(player, hand, pool, rng)
+        return None
+
+    def _deal(self, player, hand, pool, rng):
+        game = player.game.clone()
+        for clone in game.players:
+            clone.move_search = self.rollout_search
+        clone = game.players[player.seat]
+        for card_in_hand, card in zip(clone.hand, hand):
+            for counts in (clone.hand_counts, game.held_counts):
+                counts[card_in_hand.card.index] -= 1
+                counts[card.index] += 1
+            card_in_hand.card = card
+        deck = [HANABI_UNIQUE_CARD_SET[index] for index, count in enumerate(pool)
+                for _ in range(count)]
+        rng.shuffle(deck)
+        game.deck.deck = deque(deck)
+        return game
+
+    def rollout(self, deal, seat, candidate, deadline=None):
+        """The value of candidate and depth heuristic plies on a clone of deal,
+        or None if deadline passed first."""
+        game = deal.clone()
+        player = game.players[seat]
+        make_candidate(player, candidate)
+        player = player.partner
+        for _ in range(self.depth):
+            if game.blown_up or game.turns_after_trigger <= 0:
+                break
+            if deadline is not None and perf_counter() >= deadline:
+                return None
+            player.perform_turn()
+            player = player.partner
+        score = 0 if game.blown_up else game.play_area.get_score()
+        return score - self.fuse_penalty * (deal.fuse - game.fuse)
+
+
+def view_key(player):
+    """Small ints that between them fix everything player can see."""
+    game = player.game
+    key = [game.turns, player.seat, game.time, game.fuse]
+    key.extend(card_in_hand.knowledge for card_in_hand in player.hand)
+    for other in player.others():
+        key.extend(card_in_hand.card.index for card_in_hand in other.hand)
+        key.extend(card_in_hand.knowledge for card_in_hand in other.hand)
+    key.extend(card.index for card in game.discard_pile)
+    return tuple(key)
+
+
+def legal_candidates(player):
+    """Every move open to player as a (kind, arg) pair. Hints are
+    ('info', (seats, info)), seats counting from the giver, and only hints that
+    touch at least one card are offered."""
+    for position in range(len(player.hand)):
+        yield 'play', position
+    for position in range(len(player.hand)):
+        yield 'discard', position
+    if player.game.time > 0:
+        for seats, recipient in enumerate(player.others(), 1):
+            colours = {card_in_hand.card.colour for card_in_hand in recipient.hand}
+            numbers = {card_in_hand.card.number for card_in_hand in recipient.hand}
+            for colour in Colour:
+                if colour in colours:
+                    yield 'info', (seats, colour)
+            for number in range(1, 6):
+                if number in numbers:
+                    yield 'info', (seats, number)
+
+
+def candidate_for(move, player):
+    kind = move.move.__name__
+    if kind == 'give_info':
+        return 'info', (1, move.arg)
+    if kind == 'give_info_to':
+        recipient, info = move.arg
+        return 'info', ((recipient.seat - player.seat) % len(player.game.players), info)
+    return kind, move.arg
+
+
+def _recipient(player, seats):
+    recipient = player
+    for _ in range(seats):
+        recipient = recipient.partner
+    return recipient
+
+
+def move_for(candidate, player):
+    kind, arg = candidate
+    if kind == 'play':
+        return Move(player.play, arg)
+    if kind == 'discard':
+        return Move(player.discard, arg)
+    seats, info = arg
+    if seats == 1:
+        return Move(player.give_info, info)
+    return Move(player.give_info_to, (_recipient(player, seats), info))
+
+
+def make_candidate(player, candidate):
+    move_for(candidate, player).make_move()
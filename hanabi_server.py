@@ -0,0 +1,438 @@
+"""An asyncio Hanabi server for playing bots against each other over sockets.
+
+Clients talk to the server in newline delimited JSON. A client sends
+
+    {"type": "join"}
+
+once for every seat it wants. Each seat goes to the oldest table still being
+filled that the connection has no seat at, and a table starts as soon as it
+has n_players seats. One connection may hold seats at any number of tables at
+once, but never two at the same table. The server then sends
+
+    {"type": "start", "table": t, "seat": s}
+    {"type": "observation", "table": t, "seat": s, "observation": {...}}
+    {"type": "game_over", "table": t, "seat": s, "score": 17, "blown_up": false}
+
+and expects a reply to every observation of one of
+
+    {"type": "move", "table": t, "seat": s, "move": "play", "position": 0}
+    {"type": "move", "table": t, "seat": s, "move": "discard", "position": 0}
+    {"type": "move", "table": t, "seat": s, "move": "hint", "to": 1, "info": "red"}
+
+where info is a colour name or a number from 1 to 5. A seat that does not
+reply within move_timeout seconds, or replies with a move that is not legal,
+discards its oldest card instead and is sent {"type": "rejected", ...}. A line
+that is not a JSON object is answered with {"type": "rejected", "reply": line}
+and otherwise ignored, so the connection stays open. Positions, seats and
+numbers must be JSON integers. Should a table fail, its seats are still sent
+game_over, carrying an "error".
+
+An observation holds only what its seat may see: its own cards are given only
+as what is known about them, while every other hand is shown in full. To keep
+messages small, cards are given by Card.index and what a holder knows about a
+card as [knowledge, colour, number, timestamp]: the CardInHand.knowledge mask,
+the colour value and number if hinted directly or else 0, and when it was
+drawn. Each card of another hand is its Card.index followed by those four.
+fireworks are the heights of the colours in Colour order.
+"""
+import argparse
+import asyncio
+import json
+from time import perf_counter
+
+from hanabi import (HANABI_UNIQUE_CARD_SET, UNIQUE_CARDS, Card, CardInHand, Colour,
+                    DiscardCriteria, Hanabi, Move, MoveSearch, PlayCriteria, Player,
+                    empty_count_matrix, game_deck, new_master_seed)
+
+COLOURS = list(Colour)
+# possible_colours and possible_numbers for the low and high five bits of a
+# CardInHand.knowledge mask.
+POSSIBLE_COLOURS = [[colour for colour in COLOURS if bits >> colour.value - 1 & 1]
+                    for bits in range(32)]
+POSSIBLE_NUMBERS = [[number for number in range(1, 6) if bits >> number - 1 & 1]
+                    for bits in range(32)]
+
+
+class GameServer:
+    """Hosts any number of concurrent tables and runs the authoritative rules.
+
+    Table t is dealt game_deck(seed, t). Finished games are kept in results as
+    (table, score, blown_up), and tables that failed part way in failed_tables
+    as (table, error).
+    """
+
+    def __init__(self, n_players=2, move_timeout=1.0, seed=None):
+        self.n_players = n_players
+        self.move_timeout = move_timeout
+        self.seed = new_master_seed() if seed is None else seed
+        self.lobby = []
+        self.n_tables = 0
+        self.tables = set()
+        self.results = []
+        self.failed_tables = []
+        self.rejected_moves = 0
+
+    async def start_tcp(self, host='127.0.0.1', port=0):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def start_unix(self, path):
+        return await asyncio.start_unix_server(self.handle_connection, path)
+
+    async def handle_connection(self, reader, writer):
+        connection = Connection(writer)
+        try:
+            async for line in reader:
+                message = parse_message(line)
+                if message is None:
+                    connection.send({'type': 'rejected',
+                                     'reply': line.decode(errors='replace').rstrip('\n')})
+                elif message.get('type') == 'join':
+                    self.seat(connection)
+                elif message.get('type') == 'move':
+                    connection.deliver(message)
+        finally:
+            self.leave_lobby(connection)
+            connection.close()
+
+    def leave_lobby(self, connection):
+        """Gives up every seat connection holds at tables that have not started."""
+        for connections in self.lobby:
+            if connection in connections:
+                connections.remove(connection)
+        self.lobby = [connections for connections in self.lobby if connections]
+
+    def seat(self, connection):
+        for connections in self.lobby:
+            if connection not in connections:
+                connections.append(connection)
+                break
+        else:
+            connections = [connection]
+            self.lobby.append(connections)
+        if len(connections) == self.n_players:
+            self.lobby.remove(connections)
+            table = asyncio.ensure_future(self.run_table(self.n_tables, connections))
+            self.tables.add(table)
+            table.add_done_callback(self.tables.discard)
+            self.n_tables += 1
+
+    async def run_table(self, table, connections):
+        """Plays table to the end and sends every seat game_over. Should the
+        table fail, the game is scored as blown up, the error is kept in
+        failed_tables and every seat still gets game_over with the error."""
+        game = Hanabi(game_deck(self.seed, table), None, n_players=self.n_players)
+        error = None
+        try:
+            score, blown_up = await self.play_table(table, connections, game)
+            self.results.append((table, score, blown_up))
+        except Exception as table_error:
+            score, blown_up = game.play_area.get_score(), True
+            error = repr(table_error)
+            self.failed_tables.append((table, error))
+        for seat, connection in enumerate(connections):
+            message = {'type': 'game_over', 'table': table, 'seat': seat,
+                       'score': score, 'blown_up': blown_up}
+            if error is not None:
+                message['error'] = error
+            connection.send(message)
+
+    async def play_table(self, table, connections, game):
+        for seat, connection in enumerate(connections):
+            connection.send({'type': 'start', 'table': table, 'seat': seat})
+        stepper = game.steps()
+        move = None
+        while True:
+            try:
+                player = stepper.send(move)
+            except StopIteration as stop:
+                return stop.value
+            connection = connections[player.seat]
+            reply = await connection.request(table, player.seat, observe(player), self.move_timeout)
+            move = parse_move(player, reply)
+            if move is None:
+                self.rejected_moves += 1
+                connection.send({'type': 'rejected', 'table': table, 'seat': player.seat,
+                                 'reply': reply})
+                move = fallback_move(player)
+
+    async def wait_for_tables(self):
+        while self.tables:
+            await asyncio.wait(list(self.tables))
+
+
+class Connection:
+    """One client socket, with the moves it still owes keyed by (table, seat)."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = {}
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b'\n')
+
+    async def request(self, table, seat, observation, timeout):
+        """Sends an observation and waits up to timeout seconds for the reply,
+        or returns None."""
+        reply = asyncio.get_running_loop().create_future()
+        self.pending[table, seat] = reply
+        self.send({'type': 'observation', 'table': table, 'seat': seat,
+                   'observation': observation})
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(reply, timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            return None
+        finally:
+            self.pending.pop((table, seat), None)
+
+    def deliver(self, message):
+        table, seat = message.get('table'), message.get('seat')
+        if not isinstance(table, int) or not isinstance(seat, int):
+            return
+        reply = self.pending.get((table, seat))
+        if reply is not None and not reply.done():
+            reply.set_result(message)
+
+    def close(self):
+        for reply in self.pending.values():
+            if not reply.done():
+                reply.set_result(None)
+        self.writer.close()
+
+
+def parse_message(line):
+    """The JSON object on line, or None if it holds anything else."""
+    try:
+        message = json.loads(line)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def observe(player):
+    """Everything player may see, as JSON ready values."""
+    game = player.game
+    return {'seat': player.seat,
+            'n_players': len(game.players),
+            'hand': [knowledge_of(card_in_hand) for card_in_hand in player.hand],
+            'others': [[other.seat, [[card_in_hand.card.index] + knowledge_of(card_in_hand)
+                                     for card_in_hand in other.hand]]
+                       for other in player.others()],
+            'fireworks': list(game.play_area.heights),
+            'discards': [card.index for card in game.discard_pile],
+            'time': game.time,
+            'fuse': game.fuse,
+            'deck_size': len(game.deck.deck),
+            'end_trigger': game.end_trigger,
+            'turns_after_trigger': game.turns_after_trigger}
+
+
+def knowledge_of(card_in_hand):
+    """What a card's holder knows about it. colour and number are only set once
+    hinted directly, even if the other hints have ruled out everything else."""
+    colour = card_in_hand.colour
+    return [card_in_hand.knowledge, colour.value if colour else 0, card_in_hand.number or 0,
+            card_in_hand.timestamp]
+
+
+def parse_info(info):
+    # JSON gives 2.0 and true for 2 and 1 just as readily, and neither works as
+    # a number in the rules, so only a plain int is a number.
+    if isinstance(info, str) and info in Colour.__members__:
+        return Colour[info]
+    if type(info) is int and 1 <= info <= 5:
+        return info
+    return None
+
+
+def parse_move(player, message):
+    """The Move a client's reply asks player to make, or None if it is not legal."""
+    if message is None:
+        return None
+    kind = message.get('move')
+    if kind in ('play', 'discard'):
+        position = message.get('position')
+        if type(position) is int and 0 <= position < len(player.hand):
+            return Move(getattr(player, kind), position)
+    elif kind == 'hint' and player.game.time > 0:
+        info = parse_info(message.get('info'))
+        to = message.get('to')
+        for recipient in player.others():
+            if type(to) is int and recipient.seat == to and info is not None:
+                if recipient is player.partner:
+                    return Move(player.give_info, info)
+                return Move(player.give_info_to, (recipient, info))
+    return None
+
+
+def fallback_move(player):
+    oldest = min(range(len(player.hand)), key=lambda i: player.hand[i].timestamp)
+    return Move(player.discard, oldest)
+
+
+def game_view(observation, move_search):
+    """A Hanabi holding only what an observation shows, and the Player to move
+    in it, for a MoveSearch to choose a move with.
+
+    The player's own cards are CardInHand with card None unless both colour and
+    number are known. Its hand is kept out of held_counts, so unseen_counts
+    still counts the cards it holds.
+    """
+    game = Hanabi.without_players(DeckView(observation['deck_size']), observation['n_players'])
+    for colour, height in zip(COLOURS, observation['fireworks']):
+        for number in range(1, height + 1):
+            game.play_area.play(Card(colour, number))
+    game.discard_pile = [HANABI_UNIQUE_CARD_SET[index] for index in observation['discards']]
+    game.time = observation['time']
+    game.fuse = observation['fuse']
+    game.end_trigger = observation['end_trigger']
+    game.turns_after_trigger = observation['turns_after_trigger']
+    for card in game.play_area.played_cards() + game.discard_pile:
+        game.card_counts[card.index] -= 1
+
+    seats = [None] * observation['n_players']
+    seats[observation['seat']] = [(None, knowledge) for knowledge in observation['hand']]
+    for seat, cards in observation['others']:
+        seats[seat] = [(HANABI_UNIQUE_CARD_SET[card[0]], card[1:]) for card in cards]
+    game.players = [player_view(game, seat, hand, move_search) for seat, hand in enumerate(seats)]
+    for seat, player in enumerate(game.players):
+        player.partner = game.players[(seat + 1) % len(game.players)]
+        if seat != observation['seat']:
+            for card_in_hand in player.hand:
+                game.held_counts[card_in_hand.card.index] += 1
+    game.player1 = game.players[0]
+    game.player2 = game.players[1]
+    return game, game.players[observation['seat']]
+
+
+class DeckView:
+    """Stands in for Deck when only the number of cards left is known."""
+
+    def __init__(self, size):
+        self.deck = [None] * size
+
+    def is_empty(self):
+        return not self.deck
+
+
+def player_view(game, seat, hand, move_search):
+    player = Player.__new__(Player)
+    player.game = game
+    player.seat = seat
+    player.hand = [card_view(card, knowledge) for card, knowledge in hand]
+    player.timestamp = max([card_in_hand.timestamp for card_in_hand in player.hand], default=0)
+    player.hand_counts = empty_count_matrix()
+    player.move_search = move_search
+    player.partner = None
+    return player
+
+
+def card_view(card, known):
+    knowledge, colour, number, timestamp = known
+    card_in_hand = CardInHand.__new__(CardInHand)
+    card_in_hand.possible_colours = list(POSSIBLE_COLOURS[knowledge & 0b11111])
+    card_in_hand.possible_numbers = list(POSSIBLE_NUMBERS[knowledge >> 5])
+    card_in_hand.colour = COLOURS[colour - 1] if colour else None
+    card_in_hand.number = number or None
+    if card is None and colour and number:
+        card = UNIQUE_CARDS[colour - 1][number - 1]
+    card_in_hand.card = card
+    card_in_hand.timestamp = timestamp
+    card_in_hand.knowledge = knowledge
+    return card_in_hand
+
+
+def move_message(move, player):
+    kind = move.move.__name__
+    if kind in ('play', 'discard'):
+        return {'move': kind, 'position': move.arg}
+    if kind == 'give_info':
+        recipient, info = player.partner, move.arg
+    else:
+        recipient, info = move.arg
+    return {'move': 'hint', 'to': recipient.seat,
+            'info': info.name if isinstance(info, Colour) else info}
+
+
+class MoveSearchClient:
+    """A local client that plays its seats with a MoveSearch."""
+
+    def __init__(self, move_search):
+        self.move_search = move_search
+        self.results = []
+
+    async def play(self, reader, writer, n_seats, max_open=None):
+        """Joins n_seats seats and plays them until every one of their games is over.
+
+        With max_open, at most that many seats are held at once and a new one is
+        joined as each game ends, so a slow client is never sent more
+        observations at once than it can answer within the move timeout.
+        """
+        joined = n_seats if max_open is None else min(n_seats, max_open)
+        for _ in range(joined):
+            writer.write(b'{"type": "join"}\n')
+        await writer.drain()
+        while len(self.results) < n_seats:
+            line = await reader.readline()
+            if not line:
+                break
+            message = parse_message(line)
+            if message is None:
+                continue
+            if message.get('type') == 'observation':
+                _, player = game_view(message['observation'], self.move_search)
+                reply = move_message(self.move_search.get_best_move(player), player)
+                reply.update(type='move', table=message['table'], seat=message['seat'])
+                writer.write(json.dumps(reply).encode() + b'\n')
+            elif message.get('type') == 'game_over':
+                self.results.append((message['table'], message['score'], message['blown_up']))
+                if joined < n_seats:
+                    writer.write(b'{"type": "join"}\n')
+                    joined += 1
+        writer.close()
+        return self.results
+
+
+async def play_local_match(searches, n_tables, move_timeout=1.0, seed=None, max_open=64):
+    """Serves n_tables tables on a localhost port, with one MoveSearchClient
+    connection per search taking a seat at every table, max_open tables at a
+    time. Returns the server."""
+    server = GameServer(len(searches), move_timeout, seed)
+    listener = await server.start_tcp()
+    port = listener.sockets[0].getsockname()[1]
+    clients = []
+    for search in searches:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        clients.append(MoveSearchClient(search).play(reader, writer, n_tables, max_open))
+    await asyncio.gather(*clients)
+    await server.wait_for_tables()
+    listener.close()
+    await listener.wait_closed()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play MoveSearch bots through a local game server.')
+    parser.add_argument('--tables', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=1.0)
+    parser.add_argument('--open-tables', type=int, default=64,
+                        help='tables played at once')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    searches = [MoveSearch(DiscardCriteria.oldest, PlayCriteria.probabilistic, 1, 1, 0, 1)
+                for _ in range(args.players)]
+    start = perf_counter()
+    server = asyncio.run(play_local_match(searches, args.tables, args.timeout, args.seed,
+                                          args.open_tables))
+    elapsed = perf_counter() - start
+    scores = [0 if blown_up else score for _, score, blown_up in server.results]
+    print('{} tables in {:.1f}s, {:.1f} tables/s'.format(len(scores), elapsed, len(scores) / elapsed))
+    print('Mean score {:.3f}, {} moves rejected, {} tables failed'.format(
+        sum(scores) / len(scores), server.rejected_moves, len(server.failed_tables)))
+
+
+if __name__ == '__main__':
+    main()
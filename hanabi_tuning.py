@@ -0,0 +1,154 @@
+from itertools import product
+from math import sqrt
+
+import numpy as np
+
+from hanabi import DiscardCriteria, MoveSearch, PlayCriteria, new_master_seed
+from hanabi_batch import play_games
+from hanabi_corpus import open_corpus, seeded_decks
+
+SEARCH_PARAMETERS = ('discard_criteria', 'play_criteria', 'play_value', 'future_value',
+                     'rare_value', 'other_value', 'play_threshold', 'sudden_death_threshold')
+
+
+def grid_search(space):
+    """Every MoveSearch in the cross product of the values listed in space.
+
+    space maps MoveSearch constructor arguments to lists of values; the two
+    thresholds may be left out to use the MoveSearch defaults.
+    """
+    names = [name for name in SEARCH_PARAMETERS if name in space]
+    return [MoveSearch(**dict(zip(names, values)))
+            for values in product(*(space[name] for name in names))]
+
+
+def random_search(space, n_configs, seed=None):
+    """n_configs MoveSearches sampled from space.
+
+    A list in space is sampled uniformly, and a (low, high) tuple is a uniform
+    float range.
+    """
+    rng = np.random.RandomState(seed)
+    searches = []
+    for _ in range(n_configs):
+        kwargs = {}
+        for name in SEARCH_PARAMETERS:
+            if name not in space:
+                continue
+            values = space[name]
+            if isinstance(values, tuple):
+                kwargs[name] = float(rng.uniform(*values))
+            else:
+                kwargs[name] = values[rng.randint(len(values))]
+        searches.append(MoveSearch(**kwargs))
+    return searches
+
+
+def deck_source(n_games, seed, corpus):
+    """A function giving decks start to stop of a tuning run in the layout
+    hanabi_batch expects, and how many decks the run may use.
+
+    The decks are those of the corpus file at corpus if one is given, or else
+    game_deck(seed, i), so tuning plays the same deals as every other runner.
+    """
+    if corpus is not None:
+        decks = open_corpus(corpus)
+        return (lambda start, stop: np.asarray(decks[start:stop])), min(n_games, len(decks))
+    if seed is None:
+        seed = new_master_seed()
+    return (lambda start, stop: seeded_decks(seed, start, stop)), n_games
+
+
+def play_scores(search, decks):
+    """Per-game scores of search on decks, counting a blown up game as 0."""
+    scores, blown_up = play_games(decks, search)
+    return np.where(blown_up, 0, scores)
+
+
+def race(searches, n_games, seed=None, block_size=100, min_games=300, z=2.58, corpus=None):
+    """Plays every search on the same decks block by block, dropping a search as
+    soon as it is clearly worse than the current leader.
+
+    Once min_games have been played, a search is dropped when the upper bound
+    of the z-score confidence interval on its mean per-deck score difference
+    with the leader falls below zero. Decks come from deck_source. Returns
+    (search, mean score, games played) for every search, best first.
+    """
+    decks_between, n_games = deck_source(n_games, seed, corpus)
+    scores = [[] for _ in searches]
+    alive = list(range(len(searches)))
+    games_played = [0] * len(searches)
+    played = 0
+    while played < n_games and len(alive) > 1:
+        decks = decks_between(played, min(n_games, played + block_size))
+        played += len(decks)
+        for i in alive:
+            scores[i].append(play_scores(searches[i], decks))
+            games_played[i] = played
+        if played < min_games:
+            continue
+        totals = {i: np.concatenate(scores[i]) for i in alive}
+        leader = max(alive, key=lambda i: totals[i].mean())
+        survivors = []
+        for i in alive:
+            if i == leader:
+                survivors.append(i)
+                continue
+            difference = totals[i] - totals[leader]
+            standard_error = difference.std(ddof=1) / sqrt(len(difference))
+            if difference.mean() + z * standard_error >= 0:
+                survivors.append(i)
+        alive = survivors
+    return _ranked(searches, scores, games_played)
+
+
+def successive_halving(searches, n_games, seed=None, min_games=100, eta=2, corpus=None):
+    """Successive halving over searches on a shared stream of decks.
+
+    Each rung plays the survivors on the next decks until they have played
+    min_games * eta ** rung games in total, then keeps the best 1 / eta of them
+    by mean score. Stops when one search is left or n_games decks have been used.
+    Decks come from deck_source. Returns (search, mean score, games played) for
+    every search, best first.
+    """
+    decks_between, n_games = deck_source(n_games, seed, corpus)
+    scores = [[] for _ in searches]
+    alive = list(range(len(searches)))
+    games_played = [0] * len(searches)
+    played = 0
+    budget = min_games
+    while played < n_games and len(alive) > 1:
+        decks = decks_between(played, min(budget, n_games))
+        played += len(decks)
+        for i in alive:
+            scores[i].append(play_scores(searches[i], decks))
+            games_played[i] = played
+        alive.sort(key=lambda i: np.concatenate(scores[i]).mean(), reverse=True)
+        alive = alive[:max(1, len(alive) // eta)]
+        budget *= eta
+    return _ranked(searches, scores, games_played)
+
+
+def _ranked(searches, scores, games_played):
+    results = [(searches[i], np.concatenate(scores[i]).mean(), games_played[i])
+               for i in range(len(searches))]
+    results.sort(key=lambda result: (result[2], result[1]), reverse=True)
+    return results
+
+
+def print_search_results(results):
+    print('Avg | Games | Search')
+    for search, mean, games in results:
+        print('{:.3f} | {} | {}'.format(mean, games, search))
+
+
+if __name__ == '__main__':
+    space = {'discard_criteria': list(DiscardCriteria),
+             'play_criteria': [PlayCriteria.probabilistic],
+             'play_value': [1, 2],
+             'future_value': [0.5, 1],
+             'rare_value': [0, 1],
+             'other_value': [0, 1],
+             'play_threshold': (.5, 1),
+             'sudden_death_threshold': (.8, 1)}
+    print_search_results(race(random_search(space, 20, seed=0), 2000, seed=0))